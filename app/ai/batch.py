@@ -0,0 +1,343 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+
+from ai.processor import PDFProcessor
+from ai.scheduler import failed_attempt, lock_document, release_document
+from telemetry.otel import stage
+
+BATCH_ENDPOINT = "/chat/completions"
+SECTIONS = ["introduction", "results", "conclusion"]
+# Batch statuses that can still change, anything else is final
+ACTIVE_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+
+
+def batch_requests(processor, doc_id, prepared, sections, model, extraction_mode=None):
+    """
+    The batch input lines for one prepared document, using the same prompts as interactive
+    processing. Custom ids are '<document id>:<call>'.
+    """
+    if (extraction_mode or processor.extraction_mode) == "combined":
+        calls = {"combined": processor.combined_request(prepared["text"], prepared["tables_markdown"], sections)}
+    else:
+        calls = {"sections": processor.sections_request(prepared["text"], sections)}
+        if prepared["tables_markdown"]:
+            calls["tables"] = processor.tables_request(prepared["tables_markdown"])
+
+    return [
+        {"custom_id": f"{doc_id}:{call}", "method": "POST", "url": BATCH_ENDPOINT, "body": {"model": model, **request}}
+        for call, request in calls.items()
+    ]
+
+
+def parse_batch_output(lines, sections, truncated=None):
+    """
+    Turns batch output lines into {document id: values}. Documents with a failed, refused or
+    truncated call, or nothing extracted, map to None. The ids of the truncated ones are added to
+    truncated as well, when given.
+    """
+    messages = {}
+    failed = set()
+    truncated = set() if truncated is None else truncated
+    for line in lines:
+        doc_id, _, call = line["custom_id"].rpartition(":")
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            logging.warning(f"Batch request {line['custom_id']} failed: {line.get('error') or response.get('status_code')}")
+            failed.add(doc_id)
+            continue
+        choice = response["body"]["choices"][0]
+        message = choice["message"]
+        if choice.get("finish_reason") == "length":
+            logging.warning(f"Batch request {line['custom_id']} was truncated at max_tokens")
+            truncated.add(doc_id)
+            failed.add(doc_id)
+            continue
+        if message.get("refusal"):
+            logging.warning(f"OpenAI refused batch request {line['custom_id']}: {message['refusal']}")
+            failed.add(doc_id)
+            continue
+        messages.setdefault(doc_id, {})[call] = message.get("content") or ""
+
+    results = {doc_id: None for doc_id in failed}
+    for doc_id, calls in messages.items():
+        if doc_id in failed:
+            continue
+        try:
+            if "combined" in calls:
+                values, markdown_sections, tables = PDFProcessor.parse_extraction(json.loads(calls["combined"]), sections)
+            else:
+                markdown_sections = calls.get("sections", "")
+                values = PDFProcessor.parse_sections(markdown_sections, sections)
+                tables = calls.get("tables", "")
+        except Exception as e:
+            logging.error(f"Could not parse the batch output for {doc_id}: {e}")
+            results[doc_id] = None
+            continue
+
+        if PDFProcessor.extraction_empty(values, markdown_sections, tables):
+            logging.warning(f"Nothing was extracted for {doc_id}")
+            results[doc_id] = None
+            continue
+
+        introduction, results_text, conclusion = values[:3]
+        results[doc_id] = {
+            "markdown_sections": markdown_sections,
+            "introduction": introduction,
+            "results": results_text,
+            "conclusion": conclusion,
+            "tables": tables,
+        }
+    return results
+
+
+class AzureBatchBackend:
+    """
+    The Azure OpenAI batch API. Requests go to OPENAI_BATCH_DEPLOYMENT_NAME, which has to be a
+    global batch deployment.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    async def submit(self, lines):
+        data = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+        with stage("ai.batch_submit", requests=len(lines), size=len(data)):
+            file = await self.client.files.create(file=("requests.jsonl", data), purpose="batch")
+            await self.client.files.wait_for_processing(file.id)
+            batch = await self.client.batches.create(
+                input_file_id=file.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+        return batch.id
+
+    async def status(self, batch_id):
+        batch = await self.client.batches.retrieve(batch_id)
+        return batch.status
+
+    async def results(self, batch_id):
+        batch = await self.client.batches.retrieve(batch_id)
+        lines = []
+        # Failed requests are in the error file
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await self.client.files.content(file_id)
+            lines.extend(json.loads(line) for line in content.text.splitlines() if line.strip())
+        return lines
+
+
+class LocalBatchBackend:
+    """
+    Stand-in for the batch API that works on files: every batch is a directory with the
+    input.jsonl that would have been uploaded, and it completes once an output.jsonl in the batch
+    output format is put next to it (see devtools/batch_responder.py).
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    async def submit(self, lines):
+        batch_id = f"local-{uuid.uuid4()}"
+        path = os.path.join(self.directory, batch_id)
+        os.makedirs(path)
+        with open(os.path.join(path, "input.jsonl"), "w") as f:
+            for line in lines:
+                f.write(json.dumps(line) + "\n")
+        return batch_id
+
+    async def status(self, batch_id):
+        if os.path.exists(os.path.join(self.directory, batch_id, "output.jsonl")):
+            return "completed"
+        return "in_progress"
+
+    async def results(self, batch_id):
+        path = os.path.join(self.directory, batch_id, "output.jsonl")
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def batch_backend(clients=None):
+    if os.environ.get("AI_BATCH_BACKEND", "azure") == "local":
+        return LocalBatchBackend(os.environ.get("AI_BATCH_LOCAL_DIR", "batches"))
+
+    from clientlib.registry import registry
+    return AzureBatchBackend((clients or registry).openai())
+
+
+def batch_model(processor):
+    return os.environ.get("OPENAI_BATCH_DEPLOYMENT_NAME", processor.deployment_name)
+
+
+async def prepare_documents(processor, session, urls, sections, concurrency=None, separate=()):
+    """
+    Runs the interactive part (Document Intelligence, figures) for {id: pdf url} and builds the
+    batch requests, with the separate prompts for the ids in separate. Returns the request lines,
+    the prepared extras (figures, page count) by id and the final results of documents that can't
+    be processed by id.
+    """
+    concurrency = concurrency or int(os.environ.get("AI_BATCH_PREPARE_CONCURRENCY", 10))
+    slots = asyncio.Semaphore(concurrency)
+    model = batch_model(processor)
+
+    lines = []
+    prepared_by_id = {}
+    final_by_id = {}
+
+    async def prepare(doc_id, url):
+        async with slots:
+            try:
+                prepared = await processor.prepare_pdf(session, url)
+            except Exception as e:
+                logging.error(f"\nError checking the URL {url}: {e}")
+                prepared = processor.empty_result(f"failed {e}")
+
+        if "ai_processing" in prepared:
+            final_by_id[doc_id] = prepared
+            return
+        extraction_mode = "separate" if doc_id in separate else None
+        lines.extend(batch_requests(processor, doc_id, prepared, sections, model, extraction_mode))
+        prepared_by_id[doc_id] = {"images": prepared["images"], "page_count": prepared["page_count"]}
+
+    with stage("ai.batch_prepare", documents=len(urls)):
+        await asyncio.gather(*(prepare(doc_id, url) for doc_id, url in urls.items()))
+
+    return lines, prepared_by_id, final_by_id
+
+
+async def wait_for_batch(backend, batch_id, poll_interval):
+    while True:
+        status = await backend.status(batch_id)
+        if status not in ACTIVE_STATUSES:
+            return status
+        logging.info(f"Batch {batch_id} is {status}")
+        await asyncio.sleep(poll_interval)
+
+
+class BatchJobs:
+    """
+    Processes the AI backlog through the batch API. submit() locks a slice of unprocessed
+    documents, prepares them and submits their OpenAI calls as one batch; the documents stay
+    marked 'batch (<job>)' so UpdateAI leaves them alone. ingest() collects finished batches,
+    saves the results and hands back the documents whose requests failed. Jobs are tracked in
+    their own collection.
+    """
+    def __init__(self, collection, jobs, processor, backend, sections=None):
+        self.collection = collection
+        self.jobs = jobs
+        self.processor = processor
+        self.backend = backend
+        self.sections = sections or SECTIONS
+
+    def pending(self):
+        return self.jobs.count_documents({"status": "submitted"})
+
+    async def submit(self, session, limit, save):
+        """
+        save(doc, new_values) stores the result of documents that are finished without OpenAI
+        (no PDF, no text). Returns the job id, or None if nothing was submitted.
+        """
+        job_id = str(uuid.uuid4())
+        owner = f"batch {job_id}"
+
+        # Oldest first, UpdateAI works from the most important end of the backlog
+        with stage("cosmos.find_unprocessed", limit=limit):
+            candidates = self.collection.find({"ai_processed": False}, ["pdf_url"], sort=[("_id", 1)], limit=limit).to_list()
+
+        docs = {}
+        for candidate in candidates:
+            doc = lock_document(self.collection, candidate["_id"], owner)
+            if doc is not None:
+                docs[str(doc["_id"])] = doc
+        if not docs:
+            return None
+
+        urls = {doc_id: doc["pdf_url"] for doc_id, doc in docs.items()}
+        # Documents whose combined extraction was cut off before would be cut off again
+        separate = {doc_id for doc_id, doc in docs.items() if doc.get("ai_truncated")}
+        lines, prepared_by_id, final_by_id = await prepare_documents(self.processor, session, urls, self.sections, separate=separate)
+
+        for doc_id, result in final_by_id.items():
+            new_values = {
+                "markdown_sections": "",
+                "introduction": "",
+                "results": "",
+                "conclusion": "",
+                "figures": result["images"],
+                "tables": "",
+                "ai_processed": result["ai_processing"]
+            }
+            if result["ai_processing"].startswith("failed"):
+                new_values.update(failed_attempt(docs[doc_id], result["ai_processing"]))
+            await save(docs[doc_id], new_values)
+
+        if not lines:
+            return None
+
+        try:
+            batch_id = await self.backend.submit(lines)
+        except Exception as e:
+            logging.error(f"Could not submit batch {job_id}, releasing {len(prepared_by_id)} documents: {e}")
+            for doc_id in prepared_by_id:
+                release_document(self.collection, docs[doc_id]["_id"], owner)
+            return None
+
+        for doc_id, prepared in prepared_by_id.items():
+            self.collection.update_one(
+                {"_id": docs[doc_id]["_id"], "ai_processed": f'processing ({owner})'},
+                {"$set": {"figures": prepared["images"], "page_count": prepared["page_count"], "ai_processed": f'batch ({job_id})'},
+                 "$unset": {"ai_locked_at": ""}})
+
+        self.jobs.insert_one({
+            "_id": job_id,
+            "batch_id": batch_id,
+            "status": "submitted",
+            "sections": self.sections,
+            "doc_ids": [docs[doc_id]["_id"] for doc_id in prepared_by_id],
+            "requests": len(lines),
+            "created_at": datetime.now(timezone.utc),
+        })
+        logging.info(f"Submitted batch {batch_id} with {len(lines)} requests for {len(prepared_by_id)} documents")
+        return job_id
+
+    async def ingest(self, save):
+        """
+        Saves the results of every finished batch with save(doc, new_values). Returns the number
+        of documents saved.
+        """
+        saved = 0
+        for job in self.jobs.find({"status": "submitted"}).to_list():
+            status = await self.backend.status(job["batch_id"])
+            if status in ACTIVE_STATUSES:
+                continue
+
+            with stage("ai.batch_ingest", batch=job["batch_id"], status=status):
+                # Expired and cancelled batches still have results for the requests that finished
+                truncated = set()
+                results = parse_batch_output(await self.backend.results(job["batch_id"]), job["sections"], truncated)
+
+                marker = f'batch ({job["_id"]})'
+                released = 0
+                for doc in self.collection.find({"_id": {"$in": job["doc_ids"]}, "ai_processed": marker}).to_list():
+                    values = results.get(str(doc["_id"]))
+                    if str(doc["_id"]) in truncated:
+                        # Retried with the separate prompts
+                        self.collection.update_one(
+                            {"_id": doc["_id"], "ai_processed": marker},
+                            {"$set": {**failed_attempt(doc, "failed (truncated)"), "ai_truncated": True}})
+                        released += 1
+                        continue
+                    if values is None:
+                        self.collection.update_one(
+                            {"_id": doc["_id"], "ai_processed": marker},
+                            {"$set": failed_attempt(doc, f"failed (batch {status})")})
+                        released += 1
+                        continue
+                    await save(doc, {**values, "ai_processed": "successful"})
+                    saved += 1
+
+            self.jobs.update_one({"_id": job["_id"]}, {"$set": {"status": status, "finished_at": datetime.now(timezone.utc)}})
+            logging.info(f"Batch {job['batch_id']} {status}: released {released} documents back to the backlog")
+
+        return saved
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import tempfile
+from contextlib import asynccontextmanager
+
+from telemetry.otel import record_response, stage
+
+CHUNK_SIZE = 64 * 1024
+
+
+class PDFTooLarge(Exception):
+    def __init__(self, url, size, limit):
+        super().__init__(f"PDF {url} is larger than {limit} bytes ({size})")
+        self.size = size
+
+
+def max_pdf_bytes():
+    return int(os.environ.get("PDF_MAX_BYTES", 50 * 1024 * 1024))
+
+
+class ByteBudget:
+    """
+    Caps the number of PDF bytes held by the process at once. Every download reserves its size
+    (the Content-Length, or the size cap when the server does not send one) until the document
+    is closed, so a burst of large PDFs waits instead of running the worker out of memory.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_use = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, size):
+        """
+        Waits until size bytes fit in the budget and returns the amount reserved. A single
+        document larger than the whole budget still gets to run, on its own.
+        """
+        size = min(size, self.capacity)
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_use + size <= self.capacity)
+            self.in_use += size
+        return size
+
+    async def release(self, size):
+        async with self.condition:
+            self.in_use -= size
+            self.condition.notify_all()
+
+
+_budget = None
+
+
+def budget():
+    global _budget
+    if _budget is None:
+        _budget = ByteBudget(int(os.environ.get("PDF_INFLIGHT_BYTES", 256 * 1024 * 1024)))
+    return _budget
+
+
+async def _stream_to_file(resp, url, max_bytes):
+    size = 0
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as file:
+        try:
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise PDFTooLarge(url, size, max_bytes)
+                file.write(chunk)
+        except BaseException:
+            file.close()
+            os.remove(file.name)
+            raise
+    return file.name, size
+
+
+@asynccontextmanager
+async def downloaded_pdf(session, url, max_bytes=None):
+    """
+    Streams the PDF to a temporary file and yields its path, or None if the download failed.
+    Oversized PDFs are rejected from their Content-Length before the body is read, and
+    downloads without one are cut off once they pass the cap; both raise PDFTooLarge. The file
+    is deleted and its bytes returned to the in-flight budget on exit.
+    """
+    max_bytes = max_bytes or max_pdf_bytes()
+    reserved = 0
+    path = None
+    try:
+        try:
+            with stage("ai.download_pdf", url=url) as span:
+                async with session.get(url, raise_for_status=True) as resp:
+                    length = resp.content_length
+                    if length and length > max_bytes:
+                        raise PDFTooLarge(url, length, max_bytes)
+
+                    reserved = await budget().acquire(length or max_bytes)
+                    path, size = await _stream_to_file(resp, url, max_bytes)
+                    record_response("pdf", resp.status, size)
+                    span.set_attribute("size", size)
+        except PDFTooLarge:
+            raise
+        except Exception as e:
+            logging.error(f"Error downloading PDF from {url}: {e}")
+
+        yield path
+    finally:
+        if reserved:
+            await budget().release(reserved)
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
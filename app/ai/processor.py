@@ -1,66 +1,48 @@
+import json
 import logging
 import os
 import re
 import base64
 import uuid
-import aiohttp
-import aiohttp.client_exceptions
-import requests
 from io import BytesIO
 from PIL import Image
 import pymupdf
-from openai import AsyncAzureOpenAI
-from azure.core.credentials import AzureKeyCredential
-from azure.ai.documentintelligence.aio import DocumentIntelligenceClient
 from azure.ai.documentintelligence.models import AnalyzeDocumentRequest, ContentFormat
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob.aio import BlobServiceClient
+from ai.download import PDFTooLarge, downloaded_pdf, max_pdf_bytes
+from clientlib.registry import registry
+from telemetry.otel import record_tokens, stage
+
+
+class ExtractionTruncated(Exception):
+    """
+    The structured output hit max_tokens, so the JSON is cut off.
+    """
 
 
 class PDFProcessor:
-    def __init__(self):
-        # Azure Form Recognizer credentials
-        self.di_client = DocumentIntelligenceClient(
-            endpoint=os.environ.get("AZURE_FORM_RECOGNIZER_ENDPOINT"),
-            credential=AzureKeyCredential(
-                os.environ.get("AZURE_FORM_RECOGNIZER_KEY"))
-        )
+    def __init__(self, clients=None):
+        # The clients are shared by every processor in the process, see clientlib.registry
+        clients = clients or registry
+
+        # Azure Form Recognizer
+        self.di_client = clients.document_intelligence()
 
         # Azure OpenAI
-        self.aoai_client = AsyncAzureOpenAI(
-            api_key=os.environ.get("OPENAI_API_KEY"),
-            api_version=os.environ.get(
-                "OPENAI_API_VERSION", "2024-02-15-preview"),
-            azure_endpoint=os.environ.get("OPENAI_AZURE_ENDPOINT")
-        )
+        self.aoai_client = clients.openai()
         self.deployment_name = os.environ.get(
             "OPENAI_DEPLOYMENT_NAME", 'GPT-4o-20240513-global')
-        
-        account_url = os.environ.get("AZURE_STORAGE_ACCOUNT_URL")
-        default_credential = DefaultAzureCredential()
-        
-        self.blob_service_client = BlobServiceClient(account_url, credential=default_credential)
+        # "separate" uses two prompts, "combined" asks for sections and tables in one structured output
+        # call and needs a deployment with json_schema support (e.g. gpt-4o 2024-08-06)
+        self.extraction_mode = os.environ.get("AI_EXTRACTION_MODE", "separate")
 
-    @staticmethod
-    async def download_pdf_from_url(session, url):
-        """
-        Downloads the PDF from the provided URL and returns the content as a BytesIO object.
-        """
-        try:
-            async with session.get(url, raise_for_status=True) as resp:
-                content = await resp.read()
-                return BytesIO(content)
-        except requests.RequestException as e:
-            logging.error(f"Error downloading PDF from {url}: {e}")
-            return None
+        self.blob_service_client = clients.blob_service()
 
     @staticmethod
-    def crop_image_from_file(pdf_bytes, page_number, bounding_box):
+    def crop_image(doc, page_number, bounding_box):
         """
-        Crops a region from a given page in a PDF and returns it as a base64-encoded string.
+        Crops a region from a given page of an open PDF and returns it as a base64-encoded string.
         """
         try:
-            doc = pymupdf.open(stream=pdf_bytes, filetype="pdf")
             page = doc.load_page(page_number)
 
             # Convert bounding box to points
@@ -76,19 +58,12 @@ class PDFProcessor:
             img.save(buffered, format="PNG")
             img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
 
-            doc.close()
             return img_base64
         except Exception as e:
             logging.error(f"Error cropping image from PDF: {e}")
             return None
 
     async def extract_images_from_pdf(self, session, pdf_url, result):
-        pdf_bytes = await self.download_pdf_from_url(session, pdf_url)
-        if not pdf_bytes:
-            return []
-
-        base64_images = []
-
         if result is None:
             logging.info(f"Result is None for PDF {pdf_url}.")
             return []
@@ -97,37 +72,55 @@ class PDFProcessor:
             logging.info(f"No figures found in result for PDF {pdf_url}.")
             return []
 
-        for figure in result.figures:
-            try:
-                region = figure["boundingRegions"][0]["polygon"]
-                bounding_box = (
-                    region[0],  # x0 (left)
-                    region[1],  # y0 (top)
-                    region[4],  # x1 (right)
-                    region[5]   # y1 (bottom)
-                )
-                page = figure["boundingRegions"][0]["pageNumber"] - 1
+        base64_images = []
 
-                cropped_image = self.crop_image_from_file(
-                    pdf_bytes, page, bounding_box)
-                if cropped_image:
-                    base64_images.append(cropped_image)
-            except Exception as e:
-                logging.error(
-                    f"Error extracting image from PDF {pdf_url}: {e}")
-                continue
+        async with downloaded_pdf(session, pdf_url) as pdf_path:
+            if not pdf_path:
+                return []
+
+            with stage("ai.render_figures", url=pdf_url, figures=len(result.figures)):
+                try:
+                    # Opened from disk, PyMuPDF only reads the pages it renders
+                    doc = pymupdf.open(pdf_path, filetype="pdf")
+                except Exception as e:
+                    logging.error(f"Error opening PDF {pdf_url}: {e}")
+                    return []
+
+                try:
+                    for figure in result.figures:
+                        try:
+                            region = figure["boundingRegions"][0]["polygon"]
+                            bounding_box = (
+                                region[0],  # x0 (left)
+                                region[1],  # y0 (top)
+                                region[4],  # x1 (right)
+                                region[5]   # y1 (bottom)
+                            )
+                            page = figure["boundingRegions"][0]["pageNumber"] - 1
+
+                            cropped_image = self.crop_image(doc, page, bounding_box)
+                            if cropped_image:
+                                base64_images.append(cropped_image)
+                        except Exception as e:
+                            logging.error(
+                                f"Error extracting image from PDF {pdf_url}: {e}")
+                            continue
+                finally:
+                    doc.close()
 
         return base64_images
 
     async def extract_text_from_pdf(self, pdf_url):
         try:
-            poller = await self.di_client.begin_analyze_document(
-                "prebuilt-layout",
-                AnalyzeDocumentRequest(url_source=pdf_url),
-                output_content_format=ContentFormat.MARKDOWN
-            )
+            with stage("ai.document_intelligence", url=pdf_url) as span:
+                poller = await self.di_client.begin_analyze_document(
+                    "prebuilt-layout",
+                    AnalyzeDocumentRequest(url_source=pdf_url),
+                    output_content_format=ContentFormat.MARKDOWN
+                )
 
-            result = await poller.result()
+                result = await poller.result()
+                span.set_attribute("pages", len(result.pages))
 
             extracted_text = ""
             for page in result.pages:
@@ -139,7 +132,11 @@ class PDFProcessor:
             logging.error(f"Error extracting text from PDF {pdf_url}: {e}")
             return "", None
 
-    async def extract_tables(self, result):
+    @staticmethod
+    def tables_to_markdown(result):
+        """
+        Rebuilds the Document Intelligence tables as (unreviewed) markdown tables.
+        """
         tables_markdown = ""
 
         if result is None:
@@ -190,9 +187,10 @@ class PDFProcessor:
                 logging.error(f"Error processing table: {e}")
                 continue
 
-        if not tables_markdown:
-            return ""
+        return tables_markdown
 
+    @staticmethod
+    def tables_request(tables_markdown):
         prompt = f"""
         You have been given multiple tables from a scientific study that appear to be split or not properly formatted.
         Your task is to ensure that each table is not split across different sections and is formatted correctly.
@@ -203,26 +201,35 @@ class PDFProcessor:
         {tables_markdown}
         """
 
+        return {
+            "messages": [
+                {"role": "system", "content": "You are an AI assistant."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0,
+            "max_tokens": 4096
+        }
+
+    async def extract_tables(self, tables_markdown):
+        """
+        Returns the tables as markdown, or None if the OpenAI call failed.
+        """
+        if not tables_markdown:
+            return ""
+
         try:
-            response = await self.aoai_client.chat.completions.create(
-                model=self.deployment_name,
-                messages=[
-                    {"role": "system", "content": "You are an AI assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0,
-                max_tokens=4096
-            )
+            with stage("ai.openai", call="tables"):
+                response = await self.aoai_client.chat.completions.create(
+                    model=self.deployment_name, **self.tables_request(tables_markdown))
+                record_tokens("tables", response.usage)
 
             return response.choices[0].message.content
         except Exception as e:
             logging.error(f"Error processing tables with OpenAI: {e}")
-            return ""
-
-    async def extract_sections(self, text, sections):
-
-        extracted_strings = ["", "", ""]  # List to hold the three sections
+            return None
 
+    @staticmethod
+    def sections_request(text, sections):
         system_message = """
         ## Extract sections from the research paper markdown.
         """
@@ -232,35 +239,158 @@ class PDFProcessor:
         {text}
         """
 
+        return {
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0,
+            "max_tokens": 4096
+        }
+
+    @staticmethod
+    def parse_sections(markdown, sections):
+        extracted_strings = ["", "", ""]  # List to hold the three sections
+
+        for index, section in enumerate(sections):
+            # Use regex to find the section content, making it case-insensitive
+            # pattern = rf"#{1,2} {section}\n\n(.*?)(?=\n#{1,2} |\Z)"
+            pattern = rf"{section}\n\n(.*?)(?=\n|\Z)"
+            # Added re.IGNORECASE
+            match = re.search(pattern, markdown, re.IGNORECASE | re.DOTALL)
+            if match:
+                # Store content in corresponding index
+                extracted_strings[index] = match.group(1).strip()
+
+        return extracted_strings
+
+    async def extract_sections(self, text, sections):
+        """
+        Returns the three section texts and the full markdown, or None if the OpenAI call failed.
+        """
         try:
-            response = await self.aoai_client.chat.completions.create(
-                model=self.deployment_name,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0,
-                max_tokens=4096
-            )
+            with stage("ai.openai", call="sections"):
+                response = await self.aoai_client.chat.completions.create(
+                    model=self.deployment_name, **self.sections_request(text, sections))
+                record_tokens("sections", response.usage)
 
             markdown = response.choices[0].message.content
 
-            for index, section in enumerate(sections):
-                # Use regex to find the section content, making it case-insensitive
-                # pattern = rf"#{1,2} {section}\n\n(.*?)(?=\n#{1,2} |\Z)"
-                pattern = rf"{section}\n\n(.*?)(?=\n|\Z)"
-                # Added re.IGNORECASE
-                match = re.search(pattern, markdown, re.IGNORECASE | re.DOTALL)
-                if match:
-                    # Store content in corresponding index
-                    extracted_strings[index] = match.group(1).strip()
-
+            extracted_strings = self.parse_sections(markdown, sections)
             return extracted_strings[0], extracted_strings[1], extracted_strings[2], markdown
 
         except Exception as e:
             logging.error(f"Error extracting sections with OpenAI: {e}")
-            return tuple(extracted_strings + [""])
+            return None
         
+    @staticmethod
+    def extraction_schema(sections):
+        return {
+            "name": "paper_extraction",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "sections": {
+                        "type": "object",
+                        "properties": {section: {"type": "string"} for section in sections},
+                        "required": list(sections),
+                        "additionalProperties": False,
+                    },
+                    "tables": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "title": {"type": "string"},
+                                "markdown": {"type": "string"},
+                            },
+                            "required": ["title", "markdown"],
+                            "additionalProperties": False,
+                        },
+                    },
+                },
+                "required": ["sections", "tables"],
+                "additionalProperties": False,
+            },
+        }
+
+    @classmethod
+    def combined_request(cls, text, tables_markdown, sections):
+        system_message = """
+        ## Extract sections and tables from a research paper.
+        Return the full text of each requested section, or an empty string if the paper does not have it.
+        The tables may be split or badly formatted: merge the parts of each table, align headings, rows and columns,
+        and return each table as markdown with a proper title. Return an empty list if there are no tables.
+        """
+
+        prompt = f"""
+        Sections to extract: {', '.join(sections)}
+
+        Research paper text:
+        {text}
+
+        Tables:
+        {tables_markdown or 'None'}
+        """
+
+        return {
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt}
+            ],
+            "response_format": {"type": "json_schema", "json_schema": cls.extraction_schema(sections)},
+            "temperature": 0,
+            # All sections and tables come back in this one answer. gpt-4o 2024-08-06 and later, which
+            # structured outputs need anyway, return up to 16384 tokens
+            "max_tokens": int(os.environ.get("AI_COMBINED_MAX_TOKENS", 16384))
+        }
+
+    async def extract_combined(self, text, tables_markdown, sections):
+        """
+        Extracts the sections and cleans up the tables with a single structured output call.
+        Returns the section texts (in the order of sections), the sections as markdown and the
+        tables as markdown, or None if the call failed. Raises ExtractionTruncated when the answer
+        did not fit in max_tokens.
+        """
+        try:
+            with stage("ai.openai", call="combined"):
+                response = await self.aoai_client.chat.completions.create(
+                    model=self.deployment_name, **self.combined_request(text, tables_markdown, sections))
+                record_tokens("combined", response.usage)
+
+            choice = response.choices[0]
+            if choice.finish_reason == "length":
+                raise ExtractionTruncated(f"The extraction did not fit in {response.usage.completion_tokens} tokens")
+            message = choice.message
+            if getattr(message, "refusal", None):
+                logging.error(f"OpenAI refused the extraction: {message.refusal}")
+                return None
+
+            return self.parse_extraction(json.loads(message.content), sections)
+        except ExtractionTruncated:
+            raise
+        except Exception as e:
+            logging.error(f"Error extracting sections and tables with OpenAI: {e}")
+            return None
+
+    @staticmethod
+    def extraction_empty(values, markdown_sections, tables):
+        """
+        True when the model returned no sections and no tables at all.
+        """
+        return not (any(values) or markdown_sections or tables)
+
+    @staticmethod
+    def parse_extraction(extraction, sections):
+        found = extraction.get("sections", {})
+        values = [found.get(section, "").strip() for section in sections]
+        markdown_sections = "\n\n".join(
+            f"## {section.capitalize()}\n\n{value}" for section, value in zip(sections, values) if value)
+        tables = "\n\n".join(
+            f"### {table['title']}\n\n{table['markdown']}" for table in extraction.get("tables", []))
+        return values, markdown_sections, tables
+
     async def save_images_to_blob(self, images):
         container_name = os.environ.get("AZURE_STORAGE_CONTAINER_NAME", "journal-images")
         container_client = self.blob_service_client.get_container_client(container_name)
@@ -272,7 +402,8 @@ class PDFProcessor:
                 image_bytes = base64.b64decode(image)
                 blob_name = f'{str(uuid.uuid4())}.png'
                 blob_client = container_client.get_blob_client(blob_name)
-                await blob_client.upload_blob(image_bytes, overwrite=True)
+                with stage("ai.blob_upload", size=len(image_bytes)):
+                    await blob_client.upload_blob(image_bytes, overwrite=True)
                 results.append(blob_client.url)
             except Exception as e:
                 logging.error(f"Error saving image to blob: {e}")
@@ -280,78 +411,108 @@ class PDFProcessor:
 
         return results
 
-    async def process_pdf(self, session, url, sections):
-        images = []
-        tables = ""
-
+    @staticmethod
+    def empty_result(status):
+        return {
+            "markdown_sections": "",
+            "introduction": "",
+            "results": "",
+            "conclusion": "",
+            "images": "",
+            "tables": "",
+            "ai_processing": status
+        }
+
+    async def prepare_pdf(self, session, url):
+        """
+        Everything before the OpenAI calls: checks the URL, extracts the text and tables with
+        Document Intelligence and saves the figures. Returns the text, tables markdown, image
+        urls and page count, or a final result (with ai_processing set) if the PDF can't be used.
+        """
         if not url:
+            return self.empty_result("unsupported (no URL)")
+
+        content_type = None
+        content_length = None
+
+        async with session.head(url, allow_redirects=True) as resp:
+            content_type = resp.headers.get('Content-Type')
+            content_length = resp.content_length
+
+        if content_type is None or "pdf" not in content_type:
+            logging.warning(f"\nThe URL is not a PDF file: {url}")
+            return self.empty_result("unsupported (not a PDF)")
+
+        if content_length and content_length > max_pdf_bytes():
+            logging.warning(f"\nThe PDF is too large ({content_length} bytes): {url}")
+            return self.empty_result("unsupported (too large)")
+
+        logging.info(f"\nProcessing URL: {url}")
+        text, poller_result = await self.extract_text_from_pdf(url)
+        if not (text and poller_result):
+            logging.warning(f"\nNo text extracted from the PDF: {url}")
+            return self.empty_result("failed (no text extracted)")
+
+        try:
+            images = await self.extract_images_from_pdf(session, url, poller_result)
+        except PDFTooLarge as e:
+            # Only found out while downloading it when the server sends no Content-Length
+            logging.warning(f"\n{e}")
+            return self.empty_result("unsupported (too large)")
+        image_urls = await self.save_images_to_blob(images)
+
+        return {
+            "text": text,
+            "tables_markdown": self.tables_to_markdown(poller_result),
+            "images": image_urls,
+            "page_count": len(poller_result.pages),
+        }
+
+    async def process_pdf(self, session, url, sections, extraction_mode=None):
+        """
+        extraction_mode overrides AI_EXTRACTION_MODE, e.g. "separate" for documents whose combined
+        extraction was truncated before.
+        """
+        extraction_mode = extraction_mode or self.extraction_mode
+        try:
+            prepared = await self.prepare_pdf(session, url)
+            if "ai_processing" in prepared:
+                return prepared
+
+            text = prepared["text"]
+            if extraction_mode == "combined":
+                try:
+                    extraction = await self.extract_combined(text, prepared["tables_markdown"], sections)
+                except ExtractionTruncated as e:
+                    # Retrying would be cut off at the same length, the separate prompts split the output
+                    logging.warning(f"\n{e}, using the separate prompts: {url}")
+                    extraction_mode = "separate"
+                else:
+                    if extraction is None:
+                        return {**self.empty_result("failed (extraction)"), "images": prepared["images"]}
+                    (introduction, results, conclusion), markdown_sections, tables = extraction
+            if extraction_mode != "combined":
+                extraction = await self.extract_sections(text, sections)
+                tables = await self.extract_tables(prepared["tables_markdown"])
+                if extraction is None or tables is None:
+                    return {**self.empty_result("failed (extraction)"), "images": prepared["images"]}
+                introduction, results, conclusion, markdown_sections = extraction
+
+            if self.extraction_empty([introduction, results, conclusion], markdown_sections, tables):
+                logging.warning(f"\nNothing was extracted from the PDF: {url}")
+                return {**self.empty_result("failed (empty extraction)"), "images": prepared["images"]}
+
             return {
-                "markdown_sections": "",
-                "introduction": "",
-                "results": "",
-                "conclusion": "",
-                "images": "",
-                "tables": "",
-                "ai_processing": "unsupported (no URL)"
+                "markdown_sections": markdown_sections,
+                "introduction": introduction,
+                "results": results,
+                "conclusion": conclusion,
+                "images": prepared["images"],
+                "tables": tables,
+                "page_count": prepared["page_count"],
+                "ai_processing": "successful"
             }
-        else:
-            try:
-                content_type = None
-
-                async with session.head(url, allow_redirects=True) as resp:
-                    content_type = resp.headers.get('Content-Type')
-
-                if content_type is None or "pdf" not in content_type:
-                    logging.warning(f"\nThe URL is not a PDF file: {url}")
-                    return {
-                        "markdown_sections": "",
-                        "introduction": "",
-                        "results": "",
-                        "conclusion": "",
-                        "images": "",
-                        "tables": "",
-                        "ai_processing": "unsupported (not a PDF)"
-                    }
-
-                logging.info(f"\nProcessing URL: {url}")
-                text, poller_result = await self.extract_text_from_pdf(url)
-                if text and poller_result:
-                    introduction, results, conclusion, markdown_sections = await self.extract_sections(
-                        text, sections)
-                    images = await self.extract_images_from_pdf(session, url, poller_result)
-                    tables = await self.extract_tables(poller_result)
-
-                    image_urls = await self.save_images_to_blob(images)
-
-                    return {
-                        "markdown_sections": markdown_sections,
-                        "introduction": introduction,
-                        "results": results,
-                        "conclusion": conclusion,
-                        "images": image_urls,
-                        "tables": tables,
-                        "ai_processing": "successful"
-                    }
-                else:
-                    logging.warning(f"\nNo text extracted from the PDF: {url}")
-                    return {
-                        "markdown_sections": "",
-                        "introduction": "",
-                        "results": "",
-                        "conclusion": "",
-                        "images": "",
-                        "tables": "",
-                        "ai_processing": "failed (no text extracted)"
-                    }
 
-            except Exception as e:
-                logging.error(f"\nError checking the URL {url}: {e}")
-                return {
-                    "markdown_sections": "",
-                    "introduction": "",
-                    "results": "",
-                    "conclusion": "",
-                    "images": "",
-                    "tables": "",
-                    "ai_processing": f"failed {e}"
-                }
+        except Exception as e:
+            logging.error(f"\nError checking the URL {url}: {e}")
+            return self.empty_result(f"failed {e}")
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from ai.download import max_pdf_bytes
+from searchlib.keywords import canonical_keyword
+from telemetry.otel import stage
+
+PRIORITIES = ("citations", "recency", "keyword")
+
+# Sorts for find(), highest priority first. The leading ai_processed only fixes the direction for
+# the compound indexes in dblib.maintenance, it is constant under the filter
+SORTS = {
+    "citations": [("ai_processed", -1), ("citations", -1)],
+    "recency": [("ai_processed", -1), ("metadata.published_year", -1), ("metadata.published_date", -1), ("citations", -1)],
+}
+
+
+def lock_document(collection, doc_id, owner):
+    """
+    Atomically moves a document from unprocessed to processing. Returns the document if this
+    caller got the lock, None if someone else already has it.
+    """
+    return collection.find_one_and_update(
+        {"_id": doc_id, "ai_processed": False},
+        {"$set": {"ai_processed": f'processing ({owner})', "ai_locked_at": datetime.now(timezone.utc)}})
+
+
+def release_document(collection, doc_id, owner):
+    """
+    Hands a locked document back to the unprocessed pool, if this owner still holds it.
+    """
+    collection.update_one(
+        {"_id": doc_id, "ai_processed": f'processing ({owner})'},
+        {"$set": {"ai_processed": False}, "$unset": {"ai_locked_at": ""}})
+
+
+def failed_attempt(doc, status):
+    """
+    The values to store after a failed attempt: the document goes back to the backlog until it has
+    failed AI_MAX_ATTEMPTS times, after that it keeps the failure status.
+    """
+    attempts = doc.get("ai_attempts", 0) + 1
+    max_attempts = int(os.environ.get("AI_MAX_ATTEMPTS", 3))
+    return {"ai_processed": False if attempts < max_attempts else status, "ai_attempts": attempts}
+
+
+def recover_stale_locks(collection, ttl):
+    """
+    Releases documents that have been processing for longer than ttl, i.e. whose worker died or
+    timed out. Locks without a timestamp predate lock timestamps and are released as well.
+    """
+    cutoff = datetime.now(timezone.utc) - ttl
+    result = collection.update_many(
+        {"ai_processed": {"$regex": "^processing"},
+         "$or": [{"ai_locked_at": {"$lt": cutoff}}, {"ai_locked_at": {"$exists": False}}]},
+        {"$set": {"ai_processed": False}, "$unset": {"ai_locked_at": ""}})
+    return result.modified_count
+
+
+class CostModel:
+    """
+    Rough number of seconds a document takes to process: a fixed cost for the Document
+    Intelligence and OpenAI round trips plus a per-page cost, or per-MB when the page count is
+    not known yet. Documents without a known size get the default.
+    """
+    def __init__(self):
+        self.base = float(os.environ.get("AI_COST_BASE_SECONDS", 30))
+        self.per_page = float(os.environ.get("AI_COST_PER_PAGE_SECONDS", 1.5))
+        self.per_mb = float(os.environ.get("AI_COST_PER_MB_SECONDS", 5))
+        self.default = float(os.environ.get("AI_COST_DEFAULT_SECONDS", 60))
+        self.max_bytes = max_pdf_bytes()
+
+    def estimate(self, doc):
+        size = doc.get("pdf_size")
+        if size and size > self.max_bytes:
+            # Rejected from the HEAD request without downloading it
+            return 1.0
+        if doc.get("page_count"):
+            return self.base + self.per_page * doc["page_count"]
+        if size:
+            return self.base + self.per_mb * size / (1024 * 1024)
+        return self.default
+
+
+class AIBatchScheduler:
+    """
+    Processes unprocessed documents in priority order until the time budget is spent. A document
+    is only claimed by a worker that is about to start it and only if its estimated cost fits in
+    the time left, so nothing is left locked when the run ends. Documents still running at the
+    deadline are cancelled and handed back.
+    """
+    def __init__(self, collection, owner, budget=None, concurrency=None, priority=None, priority_keywords=None):
+        self.collection = collection
+        self.owner = owner
+        self.budget = budget or float(os.environ.get("AI_TIME_BUDGET_SECONDS", 240))
+        self.concurrency = concurrency or int(os.environ.get("AI_CONCURRENCY", os.environ.get("COSMOS_AI_BATCH_SIZE", 15)))
+        self.priority = priority or os.environ.get("AI_PRIORITY", "citations")
+        if self.priority not in PRIORITIES:
+            logging.warning(f"Unknown AI_PRIORITY '{self.priority}', using citations")
+            self.priority = "citations"
+        if priority_keywords is None:
+            priority_keywords = os.environ.get("AI_PRIORITY_KEYWORDS", "").split(",")
+        # Stored searchkeys are canonical, see searchlib.keywords
+        self.priority_keywords = {canonical_keyword(keyword) for keyword in priority_keywords if keyword.strip()}
+        self.candidate_limit = int(os.environ.get("AI_CANDIDATE_LIMIT", 200))
+        self.cost = CostModel()
+
+        self.processed = []
+        self.released = []
+
+    def _find(self, query, sort, limit):
+        projection = ["searchkey", "citations", "metadata", "pdf_url", "pdf_size", "pdf_size_probed", "page_count"]
+        return self.collection.find({"ai_processed": False, **query}, projection, sort=sort, limit=limit).to_list()
+
+    def candidates(self):
+        """
+        The first candidate_limit unprocessed documents in priority order, sorted by the database
+        so the order holds across the whole backlog.
+        """
+        with stage("cosmos.find_unprocessed", limit=self.candidate_limit, priority=self.priority):
+            if self.priority != "keyword":
+                return self._find({}, SORTS[self.priority], self.candidate_limit)
+
+            # The priority keywords first, then everything else, both by citations
+            docs = []
+            if self.priority_keywords:
+                docs = self._find({"searchkey": {"$in": list(self.priority_keywords)}}, SORTS["citations"], self.candidate_limit)
+            if len(docs) < self.candidate_limit:
+                docs += self._find({"searchkey": {"$nin": list(self.priority_keywords)}}, SORTS["citations"], self.candidate_limit - len(docs))
+            return docs
+
+    async def probe_sizes(self, session, docs):
+        """
+        Fills in pdf_size from a HEAD request for documents that don't have it and stores it, so
+        later runs can estimate without asking again. Servers that don't send a length are not
+        asked again either, those documents are marked pdf_size_probed.
+        """
+        async def probe(doc):
+            try:
+                async with session.head(doc["pdf_url"], allow_redirects=True) as resp:
+                    if resp.content_length:
+                        doc["pdf_size"] = resp.content_length
+            except Exception as e:
+                logging.debug(f"Could not get the size of {doc['pdf_url']}: {e}")
+
+        unknown = [doc for doc in docs if not doc.get("pdf_size") and not doc.get("pdf_size_probed") and doc.get("pdf_url")]
+        if not unknown:
+            return
+
+        with stage("ai.probe_sizes", documents=len(unknown)):
+            await asyncio.gather(*(probe(doc) for doc in unknown))
+
+        updates = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"pdf_size": doc["pdf_size"]} if doc.get("pdf_size") else {"pdf_size_probed": True}})
+            for doc in unknown
+        ]
+        self.collection.bulk_write(updates, ordered=False)
+
+    async def run(self, session, work):
+        """
+        Runs work(doc) for as many documents as fit in the budget. Returns the number of
+        documents that were processed.
+        """
+        start = time.monotonic()
+        deadline = start + self.budget
+
+        docs = self.candidates()
+        if not docs:
+            return 0
+
+        await self.probe_sizes(session, docs)
+        queue = list(docs)
+        min_cost = min(self.cost.estimate(doc) for doc in queue)
+
+        def next_document():
+            remaining = deadline - time.monotonic()
+            while queue and remaining >= min_cost:
+                doc = queue.pop(0)
+                estimate = self.cost.estimate(doc)
+                if estimate > remaining:
+                    # Something smaller further down may still fit
+                    continue
+                locked = lock_document(self.collection, doc["_id"], self.owner)
+                if locked is None:
+                    logging.info(f'Document was locked by another worker: {doc["_id"]}')
+                    continue
+                return locked, estimate
+            return None, 0
+
+        async def worker():
+            while True:
+                doc, estimate = next_document()
+                if doc is None:
+                    return
+                started = time.monotonic()
+                try:
+                    await asyncio.wait_for(work(doc), timeout=max(deadline - started, 0))
+                    self.processed.append(doc["_id"])
+                    logging.info(f'Processed {doc["_id"]} in {time.monotonic() - started:.1f}s (estimated {estimate:.1f}s)')
+                except asyncio.TimeoutError:
+                    logging.warning(f'Time budget ran out while processing {doc["_id"]}, releasing it')
+                    release_document(self.collection, doc["_id"], self.owner)
+                    self.released.append(doc["_id"])
+                except Exception as e:
+                    # Left locked, the stale lock recovery hands it back later
+                    logging.error(f'Error processing {doc["_id"]}: {e}')
+
+        with stage("ai.schedule", candidates=len(docs), budget=self.budget, priority=self.priority):
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+        return len(self.processed)
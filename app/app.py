@@ -1,89 +1,58 @@
 import argparse
-from concurrent.futures import ProcessPoolExecutor
-from functools import reduce
 import json
 import sys
-from ai.processor import PDFProcessor
+import uuid
 from searchlib.dynamed import Dynamed
 from searchlib.pubmed import PubMed
 from searchlib.semantic_scholar import SemanticScholar
+from searchlib.keywords import canonical_keyword, normalize_keywords
+from searchlib.scheduler import SourceScheduler
+from searchlib.tasks import SOURCES
+from clientlib.registry import registry
+from dblib.offload import FieldStore
+from querylib.index import parse_filters
+from querylib.service import build_index
+from telemetry.otel import configure as configure_telemetry
+from telemetry.profiling import profiled
 import asyncio
-import aiohttp
 import aiofiles
 
 
 import logging
 
 
-async def query(client, query):
-    logging.info(f'Querying {client.__class__.__name__} - {query}')
-    resp = await client.search(query)
-    return resp
+async def search_sources(search_keywords, concurrent_pm, concurrent_ss, concurrent_dm, retries, priorities=None, max_active=None, max_results=None, pdf_only=None, since=None):
+    """
+    Searches every source and returns the results with the keywords that failed per source.
+    since maps source names to {keyword: YYYY-MM-DD} for incremental refreshes.
+    """
+    since = since or {}
+    pm_session = registry.http_session("PubMed", concurrent_pm)
+    ss_session = registry.http_session("SemanticScholar", concurrent_ss)
 
-async def query_redo(redo):
-    logging.info(f'Redoing {redo}')
-    resp = await redo.client.search(redo.searchkey, redo.token)
-    return resp
+    schedulers = [
+        SourceScheduler(SemanticScholar(ss_session, max_results, pdf_only), concurrent_ss, max_active, retries),
+        SourceScheduler(PubMed(pm_session), concurrent_pm, max_active, retries),
+    ]
 
-def process_results(results):
-    redo = [result for result in results if result.__class__.__name__ == 'Redo']
-    successes = [result for result in results if not result.__class__.__name__ in ['Redo', 'Partial']]
-    partials = [result for result in results if result.__class__.__name__ == 'Partial']
-    
-    for partial in partials:
-        successes.append(partial.successes)
-        redo.append(partial.redo)
-
-    success = []
-
-    for s in successes:
-        data = [d.data for d in s]
-        success.extend(data)
-    return redo, success, len(successes) > 0
-
-def result_len(results):
-    result = 0
-    for r in results:
-        if isinstance(r, list):
-            result += len(r)
-        else:
-            result += 1
-
-    return result
-
-async def search(search_keywords, concurrent_pm, concurrent_ss, concurrent_dm, retries):
-    pm_conn = aiohttp.TCPConnector(limit=concurrent_pm)
-    ss_conn = aiohttp.TCPConnector(limit=concurrent_ss)
-#    dm_conn = aiohttp.TCPConnector(limit=concurrent_dm)
-    # set total=None because the POST is really slow and the defeault will cause any request still waiting to be processed after "total" seconds to fail.  Also set read to 10 minutes
-    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=600)
-
-    async with (
-        aiohttp.ClientSession(connector=pm_conn, timeout=timeout) as pm_session,
-        aiohttp.ClientSession(connector=ss_conn, timeout=timeout) as ss_session,
-#        aiohttp.ClientSession(connector=dm_conn, timeout=timeout) as dm_session,
-    ):
-        results = await asyncio.gather(*(query(client, searchkeyword) for client in [SemanticScholar(ss_session), PubMed(pm_session)] for searchkeyword in search_keywords))
-        logging.info(f"Finalized initial run. Return is a list of {len(results)} outputs (total elements: {result_len(results)}.")
-
-        redo, success, _ = process_results(results)
-        logging.info(f"Initial run - Success: {len(success)}, Redos: {len(redo)}")
+    if Dynamed.enabled():
+        dm_session = registry.http_session("Dynamed", concurrent_dm)
+        schedulers.append(SourceScheduler(Dynamed(dm_session), concurrent_dm, max_active, retries))
+    else:
+        logging.info("Dynamed credentials not configured, skipping Dynamed")
+    results = await asyncio.gather(*(scheduler.run(search_keywords, priorities, since.get(scheduler.name)) for scheduler in schedulers))
 
-        while redo and retries > 0:
-            logging.info(f"Retrying {len(redo)} results.")
-            results = await asyncio.gather(*(query_redo(r) for r in redo))
-            redo, new_success, any_succeded = process_results(results)
-            success.extend(new_success)
-            if not any_succeded:
-                retries -= 1
+    success = [data for result in results for data in result]
+    failures = {scheduler.name: {redo.searchkey for redo in scheduler.failures} for scheduler in schedulers}
+    logging.info(f"Success: {len(success)}, Failures: {sum(len(f) for f in failures.values())}")
 
-        logging.info(f"Success: {len(success)}, Failures: {len(redo)}")
+    return success, failures
 
-        return success
+async def search(search_keywords, concurrent_pm, concurrent_ss, concurrent_dm, retries, priorities=None, max_active=None, max_results=None, pdf_only=None, since=None):
+    success, _ = await search_sources(search_keywords, concurrent_pm, concurrent_ss, concurrent_dm, retries, priorities, max_active, max_results, pdf_only, since)
+    return success
 
-async def process_ai(session, processor, doc):
-    url = doc["pdf_url"]
-    processed_data = await processor.process_pdf(session, url, ["introduction", "results", "conclusion"])
+def ai_result(doc, processed_data):
     new_values = { 
         "markdown_sections": processed_data["markdown_sections"],
         "introduction": processed_data["introduction"],
@@ -96,18 +65,88 @@ async def process_ai(session, processor, doc):
     result = {**doc, **new_values}
     return result
 
+async def process_ai(session, processor, doc):
+    url = doc["pdf_url"]
+    processed_data = await processor.process_pdf(session, url, ["introduction", "results", "conclusion"])
+    return ai_result(doc, processed_data)
+
+async def process_ai_batch(session, processor, docs, poll_interval):
+    """
+    Same as process_ai for every document, but the OpenAI calls go through one batch (see
+    AI_BATCH_BACKEND) and this waits for it to finish.
+    """
+    from ai.batch import SECTIONS, batch_backend, parse_batch_output, prepare_documents, wait_for_batch
+
+    urls = {str(i): doc["pdf_url"] for i, doc in enumerate(docs)}
+    lines, prepared_by_id, final_by_id = await prepare_documents(processor, session, urls, SECTIONS)
+
+    status = "completed"
+    outputs = {}
+    truncated = set()
+    if lines:
+        backend = batch_backend()
+        batch_id = await backend.submit(lines)
+        logging.warning(f"Submitted batch {batch_id} with {len(lines)} requests, waiting for it to finish")
+        status = await wait_for_batch(backend, batch_id, poll_interval)
+        outputs = parse_batch_output(await backend.results(batch_id), SECTIONS, truncated)
+
+    results = []
+    for doc_id, doc in zip(urls, docs):
+        if doc_id in final_by_id:
+            results.append(ai_result(doc, final_by_id[doc_id]))
+            continue
+        values = outputs.get(doc_id)
+        if values:
+            processed_data = {**values, "ai_processing": "successful"}
+        elif doc_id in truncated:
+            processed_data = processor.empty_result("failed (truncated)")
+        else:
+            processed_data = processor.empty_result(f"failed (batch {status})")
+        processed_data["images"] = prepared_by_id[doc_id]["images"]
+        results.append(ai_result(doc, processed_data))
+    return results
+
+async def run_query(args):
+    docs = []
+    async with aiofiles.open(args.results_file, mode='r') as f:
+        async for line in f:
+            if line.strip():
+                doc = json.loads(line)
+                doc.setdefault("_id", str(len(docs)))
+                docs.append(doc)
+
+    index = build_index(docs)
+    filters = parse_filters(dict(f.split('=', 1) for f in args.filter))
+    fields = args.fields.split(',') if args.fields else None
+    response = index.search(args.query, filters, args.page, args.page_size, fields)
+    print(json.dumps(response, default=str))
+
 async def main():
     parser = argparse.ArgumentParser(description='Script to perform medical search.')
     parser.add_argument('-f', '--query_file', type=str, help="The file containing the search query", default="query.txt")
     parser.add_argument('-o', '--output_file', type=str, help="The file to write the output to", default=None)
     parser.add_argument('--with-pdf-only', action='store_true', help="Only return results with PDFs", default=False)
+    parser.add_argument('--since', type=str, help="Only fetch material newer than this date (YYYY-MM-DD)", default=None)
+    parser.add_argument('--max-results', type=int, help="Maximum number of Semantic Scholar results per keyword (most cited first)", default=None)
     parser.add_argument("--concurrent-pm", type=int, help="The number of concurrent pubmed requests to make", default=10)
     parser.add_argument('--concurrent-ss', type=int, help="The number of concurrent Semantic Scholar requests to make", default=50)
     parser.add_argument('--concurrent-dm', type=int, help="The number of concurrent Dynamed requests to make", default=10)
     parser.add_argument('--process-ai', action='store_true', help="Process the AI on the results", default=True)
     parser.add_argument('--ai-concurrency', type=int, help="How many AI threads to run at once", default=10) 
+    parser.add_argument('--ai-batch', action='store_true', help="Send the OpenAI calls through the batch API and wait for the results", default=False)
+    parser.add_argument('--batch-poll-interval', type=int, help="Seconds between batch status checks", default=60)
     parser.add_argument('-r', '--retries', type=int, default=3, help='Number of retries to make')
+    parser.add_argument('--max-active', type=int, help="How many keywords each source works on at once (default: twice its concurrency)", default=None)
+    parser.add_argument('--priority', action='append', metavar='KEYWORD=N', help="Search priority for a keyword, lower runs first (default 0)", default=[])
     parser.add_argument('-v', '--verbose', action='count', help='Enable verbose mode', default=0)
+    parser.add_argument('--trace', action='store_true', help="Print per-stage spans and metrics to stderr", default=False)
+    parser.add_argument('--profile', action='store_true', help="Write wall-clock, CPU and event loop profiles of the run to PROFILE_DIR", default=False)
+    parser.add_argument('-q', '--query', type=str, help="Search previously collected results instead of the sources", default=None)
+    parser.add_argument('--results-file', type=str, help="The results file (as written by --output_file) to query", default="results.jsonl")
+    parser.add_argument('--filter', action='append', metavar='KEY=VALUE', help="Query filter: searchkey, source, year_from, year_to, min_citations or max_citations", default=[])
+    parser.add_argument('--fields', type=str, help="Comma separated fields to return for each query result", default=None)
+    parser.add_argument('--page', type=int, default=1, help='Query results page')
+    parser.add_argument('--page-size', type=int, default=10, help='Query results per page')
     
     args = parser.parse_args()
 
@@ -116,12 +155,32 @@ async def main():
     elif args.verbose > 1:
         logging.getLogger().setLevel(logging.DEBUG)
 
+    configure_telemetry(console=args.trace)
+
+    async with profiled("app", args.profile or None):
+        await execute(args)
+
+async def execute(args):
+    if args.query is not None:
+        await run_query(args)
+        return
+
     search_keywords = []
     async with aiofiles.open(args.query_file, mode='r') as f:
         async for line in f:
-            search_keywords.append(line.strip())
+            search_keywords.append(line)
+    search_keywords = normalize_keywords(search_keywords)
+
+    priorities = {}
+    for priority in args.priority:
+        keyword, _, value = priority.rpartition('=')
+        priorities[canonical_keyword(keyword)] = int(value)
+
+    since = None
+    if args.since:
+        since = {source: {keyword: args.since for keyword in search_keywords} for source in SOURCES}
 
-    results = await search(search_keywords, args.concurrent_pm, args.concurrent_ss, args.concurrent_dm, args.retries)
+    results = await search(search_keywords, args.concurrent_pm, args.concurrent_ss, args.concurrent_dm, args.retries, priorities, args.max_active, args.max_results, args.with_pdf_only or None, since)
 
     if args.output_file:
         async with aiofiles.open(args.output_file, mode='w') as f:
@@ -130,17 +189,31 @@ async def main():
                     continue
                 await f.write(json.dumps(s) + '\n')
     else:
+        # only pulled in when AI processing runs, it brings PyMuPDF, PIL, openai and the Azure SDKs
+        from ai.processor import PDFProcessor
         processor = PDFProcessor()
-        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=600)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
+        session = registry.http_session("pdf")
 
+        if args.ai_batch:
+            results = await process_ai_batch(session, processor, [s for s in results if s['pdf_url']], args.batch_poll_interval)
+        else:
             results = await asyncio.gather(*[process_ai(session, processor, s) for s in results if s['pdf_url']])
-                
-            for s in results:
-                if args.with_pdf_only and not s['pdf_url']:
-                    continue
-                print(json.dumps(s))
+
+        # Large fields (base64 figures in particular) go to blob storage like in the function app
+        field_store = FieldStore(processor.blob_service_client)
+        results = await asyncio.gather(*[field_store.offload(s.get("_id") or uuid.uuid4(), s) for s in results])
+
+        for s in results:
+            if args.with_pdf_only and not s['pdf_url']:
+                continue
+            print(json.dumps(s))
+
+async def run():
+    try:
+        await main()
+    finally:
+        await registry.close()
 
 if __name__ == '__main__':
     logging.basicConfig(stream=sys.stderr, level=logging.WARN)
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(run())
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""
+Reports the import (cold start) cost of the function app and its modules.
+
+Each module is imported in a fresh interpreter with -X importtime, so the numbers include
+everything it pulls in. Run from the app directory:
+
+    python benchmarks/startup.py [module ...] [--runs N] [--top N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+MODULES = [
+    "function_app",
+    "app",
+    "ai.processor",
+    "clientlib.registry",
+    "searchlib.pubmed",
+    "searchlib.semantic_scholar",
+    "dblib.maintenance",
+    "querylib.service",
+    "telemetry.otel",
+]
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(module):
+    """
+    Imports module in a new interpreter and returns the wall time in seconds and the
+    cumulative import time in microseconds of every module it loaded.
+    """
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR, capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - start
+
+    cumulative = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, total, name = line[len("import time:"):].split("|")
+            cumulative[name.strip()] = int(total)
+        except ValueError:
+            continue
+
+    return elapsed, cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start import times.')
+    parser.add_argument('modules', nargs='*', default=MODULES, help="Modules to measure")
+    parser.add_argument('--runs', type=int, default=3, help="Fresh interpreters per module (the median is reported)")
+    parser.add_argument('--top', type=int, default=5, help="Heaviest dependencies to list per module")
+    args = parser.parse_args()
+
+    # the interpreter itself, subtracted from every measurement
+    baseline = statistics.median(import_time("sys")[0] for _ in range(args.runs))
+    print(f"{'module':32} {'wall ms':>10} {'import ms':>10}")
+
+    for module in args.modules:
+        runs = [import_time(module) for _ in range(args.runs)]
+        wall = statistics.median(elapsed for elapsed, _ in runs) - baseline
+        cumulative = runs[-1][1]
+        total = cumulative.get(module, 0) / 1000
+        print(f"{module:32} {wall * 1000:10.1f} {total:10.1f}")
+
+        heaviest = sorted(
+            ((name, us) for name, us in cumulative.items() if name != module and "." not in name),
+            key=lambda item: item[1], reverse=True)[:args.top]
+        for name, us in heaviest:
+            print(f"    {name:28} {'':>10} {us / 1000:10.1f}")
+
+
+if __name__ == '__main__':
+    main()
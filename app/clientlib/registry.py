@@ -0,0 +1,128 @@
+import asyncio
+import atexit
+import logging
+import os
+
+import aiohttp
+import pymongo
+
+from telemetry.otel import cache_hits_counter
+
+
+class ClientRegistry:
+    """
+    Long-lived clients shared by every invocation in the worker process, so TLS sessions,
+    credential tokens, DNS lookups and connection pools are reused instead of rebuilt (and
+    leaked) each time. Clients are created (and the Azure SDKs imported) on first use. HTTP sessions are keyed by name and
+    the connection limit given on first use sticks for the life of the session.
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._mongo = None
+        self._credential = None
+        self._blob_service = None
+        self._document_intelligence = None
+        self._openai = None
+
+    def _reused(self, client):
+        cache_hits_counter.add(1, {"cache": f"client.{client}"})
+
+    def http_session(self, name="default", limit=100):
+        loop = asyncio.get_running_loop()
+        entry = self._sessions.get(name)
+        if entry is not None and entry[0] is loop and not entry[1].closed:
+            self._reused(f"http.{name}")
+            return entry[1]
+
+        connector = aiohttp.TCPConnector(
+            limit=limit,
+            ttl_dns_cache=int(os.environ.get("HTTP_DNS_CACHE_SECONDS", 300)),
+            keepalive_timeout=int(os.environ.get("HTTP_KEEPALIVE_SECONDS", 60)),
+        )
+        # set total=None because the POST is really slow and the defeault will cause any request still waiting to be processed after "total" seconds to fail.  Also set read to 10 minutes
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=600)
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self._sessions[name] = (loop, session)
+        logging.debug(f"Created HTTP session {name} (limit: {limit})")
+        return session
+
+    def mongo(self):
+        if self._mongo is None:
+            self._mongo = pymongo.MongoClient(os.environ.get("COSMOS_CONNECTION_STRING"))
+        else:
+            self._reused("mongo")
+        return self._mongo
+
+    def collection(self, name=None):
+        database = self.mongo().get_database(os.environ.get("COSMOS_DATABASE_NAME"))
+        return database.get_collection(name or os.environ.get("COSMOS_COLLECTION_NAME"))
+
+    def credential(self):
+        if self._credential is None:
+            from azure.identity.aio import DefaultAzureCredential
+            self._credential = DefaultAzureCredential()
+        return self._credential
+
+    def blob_service(self):
+        if self._blob_service is None:
+            from azure.storage.blob.aio import BlobServiceClient
+            account_url = os.environ.get("AZURE_STORAGE_ACCOUNT_URL")
+            self._blob_service = BlobServiceClient(account_url, credential=self.credential())
+        else:
+            self._reused("blob")
+        return self._blob_service
+
+    def document_intelligence(self):
+        if self._document_intelligence is None:
+            from azure.ai.documentintelligence.aio import DocumentIntelligenceClient
+            from azure.core.credentials import AzureKeyCredential
+            self._document_intelligence = DocumentIntelligenceClient(
+                endpoint=os.environ.get("AZURE_FORM_RECOGNIZER_ENDPOINT"),
+                credential=AzureKeyCredential(
+                    os.environ.get("AZURE_FORM_RECOGNIZER_KEY"))
+            )
+        else:
+            self._reused("document_intelligence")
+        return self._document_intelligence
+
+    def openai(self):
+        if self._openai is None:
+            from openai import AsyncAzureOpenAI
+            self._openai = AsyncAzureOpenAI(
+                api_key=os.environ.get("OPENAI_API_KEY"),
+                api_version=os.environ.get(
+                    "OPENAI_API_VERSION", "2024-08-01-preview"),
+                azure_endpoint=os.environ.get("OPENAI_AZURE_ENDPOINT")
+            )
+        else:
+            self._reused("openai")
+        return self._openai
+
+    async def close(self):
+        for _, session in self._sessions.values():
+            await session.close()
+        self._sessions = {}
+
+        for client in (self._document_intelligence, self._openai, self._blob_service, self._credential):
+            if client is not None:
+                try:
+                    await client.close()
+                except Exception as e:
+                    logging.warning(f"Error closing {client.__class__.__name__}: {e}")
+        self._document_intelligence = None
+        self._openai = None
+        self._blob_service = None
+        self._credential = None
+
+        self.close_sync()
+
+    def close_sync(self):
+        if self._mongo is not None:
+            self._mongo.close()
+            self._mongo = None
+
+
+registry = ClientRegistry()
+
+# The functions host gives no shutdown hook to async code, so at least release the database pool
+atexit.register(registry.close_sync)
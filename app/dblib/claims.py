@@ -0,0 +1,77 @@
+import logging
+import os
+import socket
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+
+# Searches running in this process per keyword, the database claim is only released when the last one ends
+_local = Counter()
+
+
+def instance_id():
+    return f'{os.environ.get("WEBSITE_INSTANCE_ID", socket.gethostname())}:{os.getpid()}'
+
+
+class KeywordClaims:
+    """
+    Lightweight cross-instance claims on keywords, so parallel function instances do not crawl
+    the same keyword at once. A claim belongs to a process: searches in the same process can
+    share it (their upstream calls are coalesced anyway), other instances are turned away until
+    it is released or its TTL runs out.
+    """
+    def __init__(self, collection, ttl=None, owner=None):
+        self.collection = collection
+        self.ttl = timedelta(seconds=int(ttl or os.environ.get("KEYWORD_CLAIM_TTL_SECONDS", 900)))
+        self.owner = owner or instance_id()
+
+    def reserve(self, keyword):
+        """
+        Takes (or extends) the claim in the database without tracking it locally, for work that
+        outlives this invocation and is not released explicitly, like queued searches.
+        """
+        now = datetime.now(timezone.utc)
+        claim = {"owner": self.owner, "expires_at": now + self.ttl}
+        try:
+            self.collection.insert_one({"_id": keyword, **claim})
+        except DuplicateKeyError:
+            taken = self.collection.find_one_and_update(
+                {"_id": keyword, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": claim})
+            if taken is None:
+                logging.info(f"Keyword '{keyword}' is being searched by another instance")
+                return False
+        return True
+
+    def claim(self, keyword):
+        if _local[keyword] == 0 and not self.reserve(keyword):
+            return False
+        _local[keyword] += 1
+        return True
+
+    def release(self, keyword):
+        _local[keyword] -= 1
+        if _local[keyword] > 0:
+            return
+        del _local[keyword]
+        self.collection.delete_one({"_id": keyword, "owner": self.owner})
+
+    def claim_many(self, keywords, hold=False):
+        """
+        Returns the keywords that were claimed and those already claimed elsewhere. With hold the
+        claims are only reserved and left to expire.
+        """
+        claim = self.reserve if hold else self.claim
+        claimed, busy = [], []
+        for keyword in keywords:
+            (claimed if claim(keyword) else busy).append(keyword)
+        return claimed, busy
+
+    def release_many(self, keywords):
+        for keyword in keywords:
+            try:
+                self.release(keyword)
+            except Exception as e:
+                logging.warning(f"Could not release claim on '{keyword}', it will expire: {e}")
@@ -0,0 +1,82 @@
+import logging
+import os
+import pymongo
+from pymongo.errors import OperationFailure
+
+from telemetry.otel import stage
+
+
+# (name, keys, options) for the access paths the functions use
+INDEXES = [
+    ("searchkey_1", [("searchkey", pymongo.ASCENDING)], {}),
+    # refreshes merge on these
+    ("searchkey_1_source_1_external_id_1", [("searchkey", pymongo.ASCENDING), ("source", pymongo.ASCENDING), ("external_id", pymongo.ASCENDING)], {}),
+    # UpdateAI picks unprocessed documents in priority order (see ai.scheduler). The sorts run all
+    # descending, the reverse of these, which Cosmos DB can serve from the same index
+    ("ai_processed_1_citations_1", [("ai_processed", pymongo.ASCENDING), ("citations", pymongo.ASCENDING)], {}),
+    ("ai_processed_1_published_1_citations_1", [("ai_processed", pymongo.ASCENDING), ("metadata.published_year", pymongo.ASCENDING), ("metadata.published_date", pymongo.ASCENDING), ("citations", pymongo.ASCENDING)], {}),
+]
+
+# UpdateAI only ever looks for unprocessed documents, which are a small part of the collection
+UNPROCESSED_INDEX = ("ai_unprocessed", [("ai_processed", pymongo.ASCENDING)], {"partialFilterExpression": {"ai_processed": False}})
+# Cosmos DB (RU) does not support partial indexes, so fall back to indexing the whole field there
+UNPROCESSED_FALLBACK_INDEX = ("ai_processed_1", [("ai_processed", pymongo.ASCENDING)], {})
+
+_ensured = set()
+
+
+def _create_index(collection, name, keys, options):
+    collection.create_index(keys, name=name, **options)
+    logging.info(f"Created index {name} on {collection.name}")
+
+
+def ensure_indexes(collection, force=False):
+    """
+    Creates the indexes the functions rely on. Only runs once per collection per process
+    unless forced, and only creates the indexes that are missing.
+    """
+    if collection.full_name in _ensured and not force:
+        return
+
+    with stage("cosmos.ensure_indexes", collection=collection.name):
+        existing = {index["name"] for index in collection.list_indexes()}
+
+        for name, keys, options in INDEXES:
+            if name not in existing:
+                _create_index(collection, name, keys, options)
+
+        if UNPROCESSED_INDEX[0] not in existing and UNPROCESSED_FALLBACK_INDEX[0] not in existing:
+            try:
+                _create_index(collection, *UNPROCESSED_INDEX)
+            except OperationFailure as e:
+                logging.warning(f"Partial index not supported ({e}), indexing all of ai_processed instead")
+                _create_index(collection, *UNPROCESSED_FALLBACK_INDEX)
+
+    _ensured.add(collection.full_name)
+
+
+def delete_keywords(collection, keywords):
+    with stage("cosmos.delete_keywords", keywords=len(keywords)):
+        result = collection.delete_many({"searchkey": {"$in": list(keywords)}})
+    logging.info(f"Deleted {result.deleted_count} documents for {keywords}")
+    return result.deleted_count
+
+
+def clear_collection(collection, batch_size=None):
+    """
+    Deletes every document in batches of CLEAR_BATCH_SIZE ids, so no single request runs into the
+    Cosmos DB request unit or timeout limits. Dropping and recreating the collection would be
+    cheaper, but the collection is managed by Terraform (infra/db.tf): a recreated one loses its
+    indexes and settings until the next apply, and CreateCollection cannot restore all of them.
+    """
+    batch_size = batch_size or int(os.environ.get("CLEAR_BATCH_SIZE", 1000))
+    deleted = 0
+    with stage("cosmos.clear_collection", collection=collection.name):
+        while True:
+            ids = [doc["_id"] for doc in collection.find({}, ["_id"], limit=batch_size)]
+            if not ids:
+                break
+            deleted += collection.delete_many({"_id": {"$in": ids}}).deleted_count
+
+    logging.info(f"Deleted {deleted} documents from {collection.name}")
+    return deleted
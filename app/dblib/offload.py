@@ -0,0 +1,113 @@
+import gzip
+import json
+import logging
+import os
+
+from telemetry.otel import stage
+
+
+# Fields written by the AI processing that can grow to megabytes
+OFFLOAD_FIELDS = ["markdown_sections", "tables", "introduction", "results", "conclusion", "figures"]
+
+EXTENSIONS = {
+    "zstd": "zst",
+    "gzip": "gz",
+}
+
+
+def is_offloaded(value):
+    return isinstance(value, dict) and value.get("offloaded") is True
+
+
+def compress(codec, raw):
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=10).compress(raw)
+    elif codec == "gzip":
+        return gzip.compress(raw)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def decompress(codec, data):
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "gzip":
+        return gzip.decompress(data)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+class FieldStore:
+    """
+    Moves large document fields into compressed blobs. The document keeps a reference with
+    the blob name, codec, original size and a short preview, and the full value is only
+    downloaded when load() is asked for it.
+    """
+    def __init__(self, blob_service_client):
+        self.blob_service_client = blob_service_client
+        self.container_name = os.environ.get("AZURE_STORAGE_OFFLOAD_CONTAINER", "journal-fields")
+        self.threshold = int(os.environ.get("OFFLOAD_THRESHOLD_BYTES", 16 * 1024))
+        self.preview_size = int(os.environ.get("OFFLOAD_PREVIEW_CHARS", 500))
+        self.codec = os.environ.get("OFFLOAD_CODEC", "zstd")
+
+    def _preview(self, value):
+        text = value if isinstance(value, str) else json.dumps(value)
+        return text[:self.preview_size]
+
+    async def offload(self, doc_id, values):
+        """
+        Returns a copy of values with every field in OFFLOAD_FIELDS larger than the threshold
+        replaced by a blob reference.
+        """
+        container_client = self.blob_service_client.get_container_client(self.container_name)
+        result = dict(values)
+
+        for field in OFFLOAD_FIELDS:
+            value = values.get(field)
+            if value is None or is_offloaded(value):
+                continue
+
+            raw = json.dumps(value).encode('utf-8')
+            if len(raw) < self.threshold:
+                continue
+
+            blob_name = f'{doc_id}/{field}.json.{EXTENSIONS[self.codec]}'
+            try:
+                with stage("cosmos.offload_field", field=field, size=len(raw)) as span:
+                    data = compress(self.codec, raw)
+                    span.set_attribute("compressed_size", len(data))
+                    await container_client.upload_blob(blob_name, data, overwrite=True)
+            except Exception as e:
+                logging.error(f"Error offloading {field} of {doc_id}, keeping it inline: {e}")
+                continue
+
+            result[field] = {
+                "offloaded": True,
+                "blob": blob_name,
+                "codec": self.codec,
+                "size": len(raw),
+                "preview": self._preview(value),
+            }
+            logging.info(f"Offloaded {field} of {doc_id} ({len(raw)} -> {len(data)} bytes)")
+
+        return result
+
+    async def load(self, doc, fields=None):
+        """
+        Returns a copy of doc with the offloaded fields (or only the requested ones) replaced by
+        their full values.
+        """
+        container_client = self.blob_service_client.get_container_client(self.container_name)
+        result = dict(doc)
+
+        for field in fields or OFFLOAD_FIELDS:
+            reference = doc.get(field)
+            if not is_offloaded(reference):
+                continue
+
+            with stage("cosmos.load_field", field=field, size=reference["size"]):
+                downloader = await container_client.download_blob(reference["blob"])
+                data = await downloader.readall()
+                result[field] = json.loads(decompress(reference["codec"], data))
+
+        return result
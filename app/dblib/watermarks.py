@@ -0,0 +1,62 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+
+
+class Watermarks:
+    """
+    Per (keyword, source) record of when the keyword was last fully synced, so refreshes can ask
+    the sources for newer material only. Refreshes start OVERLAP_DAYS before the watermark so
+    anything indexed late by a source is not missed; the merge takes care of the overlap.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.overlap = timedelta(days=int(os.environ.get("REFRESH_OVERLAP_DAYS", 2)))
+
+    @staticmethod
+    def _id(keyword, source):
+        return f'{source}:{keyword}'
+
+    def since(self, keywords, sources):
+        """
+        Returns {source: {keyword: YYYY-MM-DD}} for the keywords that have a watermark.
+        """
+        result = {source: {} for source in sources}
+        ids = [self._id(keyword, source) for keyword in keywords for source in sources]
+        for watermark in self.collection.find({"_id": {"$in": ids}}):
+            if watermark["source"] in result:
+                start = watermark["synced_at"] - self.overlap
+                result[watermark["source"]][watermark["keyword"]] = start.strftime("%Y-%m-%d")
+        return result
+
+    def advance(self, keywords, sources, synced_at, failures=None):
+        """
+        Moves the watermark to synced_at (the time the search started) for every keyword and
+        source that did not fail.
+        """
+        failures = failures or {}
+        operations = [
+            UpdateOne(
+                {"_id": self._id(keyword, source)},
+                {"$set": {"keyword": keyword, "source": source, "synced_at": synced_at}},
+                upsert=True)
+            for source in sources
+            for keyword in keywords
+            if keyword not in failures.get(source, set())
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+    def stale_keywords(self, max_age, limit):
+        """
+        The keywords whose oldest watermark is older than max_age, oldest first.
+        """
+        cutoff = datetime.now(timezone.utc) - max_age
+        pipeline = [
+            {"$group": {"_id": "$keyword", "synced_at": {"$min": "$synced_at"}}},
+            {"$match": {"synced_at": {"$lt": cutoff}}},
+            {"$sort": {"synced_at": 1}},
+            {"$limit": limit},
+        ]
+        return [row["_id"] for row in self.collection.aggregate(pipeline)]
@@ -0,0 +1,61 @@
+"""
+Completes the batches of the local batch backend (AI_BATCH_BACKEND=local) with canned responses,
+for exercising batch submission and ingestion without the batch API. Every pending batch under
+--directory (AI_BATCH_LOCAL_DIR) gets an output.jsonl; structured output requests are answered
+with placeholder sections and a table, and --fail-every N turns every Nth request into an error.
+
+    python devtools/batch_responder.py --directory batches
+"""
+import argparse
+import json
+import logging
+import os
+
+
+def respond(request):
+    body = request["body"]
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        sections = response_format["json_schema"]["schema"]["properties"]["sections"]["required"]
+        content = json.dumps({
+            "sections": {section: f"Stub {section}." for section in sections},
+            "tables": [{"title": "Stub table", "markdown": "| a | b |\n| --- | --- |\n| 1 | 2 |"}],
+        })
+    else:
+        content = "\n\n".join(["Stub response.", "Introduction\n\nStub introduction.", "Results\n\nStub results.", "Conclusion\n\nStub conclusion."])
+
+    return {
+        "status_code": 200,
+        "body": {
+            "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        },
+    }
+
+
+def complete(path, fail_every):
+    with open(os.path.join(path, "input.jsonl")) as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+
+    with open(os.path.join(path, "output.jsonl"), "w") as f:
+        for number, request in enumerate(requests, 1):
+            if fail_every and number % fail_every == 0:
+                line = {"custom_id": request["custom_id"], "response": None, "error": {"code": "stub_error", "message": "Failed by the stub"}}
+            else:
+                line = {"custom_id": request["custom_id"], "response": respond(request), "error": None}
+            f.write(json.dumps(line) + "\n")
+
+    logging.info(f"Completed {os.path.basename(path)} ({len(requests)} requests)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Completes local AI batches with canned responses.')
+    parser.add_argument('--directory', type=str, default=os.environ.get("AI_BATCH_LOCAL_DIR", "batches"))
+    parser.add_argument('--fail-every', type=int, default=0, help="Fail every Nth request")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for name in sorted(os.listdir(args.directory)):
+        path = os.path.join(args.directory, name)
+        if os.path.exists(os.path.join(path, "input.jsonl")) and not os.path.exists(os.path.join(path, "output.jsonl")):
+            complete(path, args.fail_every)
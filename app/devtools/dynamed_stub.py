@@ -0,0 +1,63 @@
+"""
+Local stand-in for the Dynamed OAuth and search endpoints, for exercising the token cache
+and 401 handling without real credentials. Tokens expire after --expires-in seconds and the
+server logs every token it issues. Point the app at it with:
+
+    DYNAMED_TOKEN_URL=http://localhost:8081/token
+    DYNAMED_BASE_URL=http://localhost:8081/search
+    DYNAMED_CLIENT_ID=stub
+    DYNAMED_CLIENT_SECRET=stub
+"""
+import argparse
+import logging
+import time
+import uuid
+
+from aiohttp import web
+
+
+def make_app(expires_in, reject_every):
+    tokens = {}
+    counts = {"issued": 0, "searches": 0}
+
+    async def token(request):
+        form = await request.post()
+        if form.get('grant_type') != 'client_credentials' or not form.get('client_id'):
+            return web.json_response({"error": "invalid_request"}, status=400)
+
+        access_token = uuid.uuid4().hex
+        tokens[access_token] = time.monotonic() + expires_in
+        counts["issued"] += 1
+        logging.info(f"Issued token #{counts['issued']}")
+        return web.json_response({"access_token": access_token, "token_type": "bearer", "expires_in": expires_in})
+
+    async def search(request):
+        counts["searches"] += 1
+        access_token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        expires_at = tokens.get(access_token)
+        revoked = reject_every and counts["searches"] % reject_every == 0
+        if expires_at is None or expires_at < time.monotonic() or revoked:
+            tokens.pop(access_token, None)
+            return web.json_response({"name": "Unauthorized"}, status=401)
+
+        body = await request.json() if request.can_read_body else {}
+        query = body.get('query', '')
+        return web.json_response({"data": [
+            {"title": f"{query} overview", "year": "2024", "publicationDate": "2024-01-01", "authors": [{"name": "Stub Author"}], "abstract": "Stub"},
+        ]})
+
+    app = web.Application()
+    app.router.add_post('/token', token)
+    app.router.add_get('/search', search)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dynamed auth and search stub.')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--expires-in', type=int, default=120, help="Token lifetime in seconds")
+    parser.add_argument('--reject-every', type=int, default=0, help="Revoke the token on every Nth search to force 401s")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(make_app(args.expires_in, args.reject_every), port=args.port)
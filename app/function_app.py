@@ -1,35 +1,59 @@
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import json
 import os
+import typing
 import uuid
-from ai.processor import PDFProcessor
-import aiohttp
 import azure.functions as func
 import logging
-from app import search
-import pymongo
+from ai.scheduler import AIBatchScheduler, failed_attempt, lock_document, recover_stale_locks, release_document
+from app import search_sources
+from bson import ObjectId
 from itertools import islice
+from clientlib.registry import registry
+from dblib.claims import KeywordClaims
+from dblib.maintenance import clear_collection, delete_keywords, ensure_indexes
+from dblib.offload import OFFLOAD_FIELDS, FieldStore
+from dblib.watermarks import Watermarks
+from querylib.index import parse_filters
+from querylib.service import index_documents, invalidate_index, shared_index
+from searchlib.keywords import canonical_keyword, normalize_keywords
+from searchlib.tasks import enabled_sources, run_search_message, search_messages
+from pymongo import UpdateOne
+from telemetry.otel import configure as configure_telemetry, stage
+from telemetry.profiling import profile_function
 
 app = func.FunctionApp()
+configure_telemetry()
 
+SEARCH_QUEUE = "search-requests"
+AI_QUEUE = "ai-requests"
+QUEUE_CONNECTION = "AzureWebJobsStorage"
 
-def get_db_connection():
-    CONNECTION_STRING = os.environ.get("COSMOS_CONNECTION_STRING")
-    DATATBASE_NAME = os.environ.get("COSMOS_DATABASE_NAME")
-    COLLECTION_NAME = os.environ.get("COSMOS_COLLECTION_NAME")
 
-    client = pymongo.MongoClient(CONNECTION_STRING)
-    database = client.get_database(DATATBASE_NAME)
-    collection = database.get_collection(COLLECTION_NAME)
-    return client, collection
+def get_collection():
+    # the client behind the collection is shared by the whole process, so it is never closed here
+    collection = registry.collection()
+    ensure_indexes(collection)
+    return collection
 
 
-def delete_keyword(keyword):
-    logging.info(f"Deleting keyword: {keyword} from DB")
-    client, collection = get_db_connection()
-    docs = collection.delete_many({"searchkey": keyword})
-    logging.info(f"Deleted {docs.deleted_count} documents")
-    client.close()
+def get_claims():
+    return KeywordClaims(registry.collection(os.environ.get("COSMOS_CLAIMS_COLLECTION_NAME", "claims")))
+
+
+def get_watermarks():
+    return Watermarks(registry.collection(os.environ.get("COSMOS_WATERMARKS_COLLECTION_NAME", "watermarks")))
+
+
+def search_settings():
+    concurrent_pm = int(os.environ.get("CONCURRENT_PUBMED", 10))
+    concurrent_ss = int(os.environ.get("CONCURRENT_SEMANTIC_SCHOLAR", 50))
+    concurrent_dm = int(os.environ.get("CONCURRENT_DYNAMED", 10))
+    retries = int(os.environ.get("SOURCE_RETRIES", 3))
+    max_active = os.environ.get("SEARCH_MAX_ACTIVE_KEYWORDS")
+    max_active = int(max_active) if max_active else None
+    return concurrent_pm, concurrent_ss, concurrent_dm, retries, max_active
 
 
 def batched(iterable, chunk_size):
@@ -38,7 +62,7 @@ def batched(iterable, chunk_size):
         yield chunk
 
 
-async def save_to_db(results):
+def get_batch_size():
     BATCH_SIZE = os.environ.get("COSMOS_BATCH_SIZE", 1000)
 
     batch_size = 1000
@@ -48,26 +72,90 @@ async def save_to_db(results):
     except ValueError:
         logging.error(f"Invalid batch size: '{BATCH_SIZE}'")
 
-    results_chunks = batched(results, batch_size)
+    return batch_size
+
 
-    client, collection = get_db_connection()
+async def save_to_db(results):
+    results_chunks = batched(results, get_batch_size())
+
+    collection = get_collection()
 
     logging.debug(f"Database connection established.")
 
+    inserted_ids = []
     for chunk in results_chunks:
-        collection.insert_many(chunk)
+        # insert_many adds _id to what it is given, and coalesced searches share their results
+        documents = [dict(doc) for doc in chunk]
+        with stage("cosmos.insert", documents=len(documents)):
+            result = collection.insert_many(documents)
+        inserted_ids.extend(result.inserted_ids)
+        index_documents(documents)
         logging.info(f"Wrote {len(chunk)} results to the database")
         await asyncio.sleep(1)
 
-    client.close()
+    return inserted_ids
+
+
+async def merge_to_db(results):
+    """
+    Upserts results on (searchkey, source, external_id), falling back to the title when the
+    source has no id. Existing documents only get their citation count updated, so AI results
+    are kept. Returns the ids of the documents that were new.
+    """
+    collection = get_collection()
+
+    new_ids = []
+    for chunk in batched(results, get_batch_size()):
+        operations = []
+        for doc in chunk:
+            key = {"searchkey": doc["searchkey"], "source": doc["source"]}
+            if doc.get("external_id"):
+                key["external_id"] = doc["external_id"]
+            else:
+                key["title"] = doc["title"]
+            new_doc = {field: value for field, value in doc.items() if field != "citations"}
+            operations.append(UpdateOne(key, {"$setOnInsert": new_doc, "$set": {"citations": doc["citations"]}}, upsert=True))
+
+        with stage("cosmos.merge", documents=len(operations)):
+            result = collection.bulk_write(operations, ordered=False)
+
+        documents = [{**chunk[position], "_id": doc_id} for position, doc_id in result.upserted_ids.items()]
+        new_ids.extend(doc["_id"] for doc in documents)
+        index_documents(documents)
+        logging.info(f"Merged {len(chunk)} results into the database ({len(documents)} new)")
+        await asyncio.sleep(1)
+
+    return new_ids
+
+
+async def refresh_keywords(keywords, priorities=None):
+    """
+    Fetches only what is newer than each keyword's watermark, merges it into the collection
+    and moves the watermarks forward for the sources that succeeded. Keywords without a
+    watermark are searched in full.
+    """
+    concurrent_pm, concurrent_ss, concurrent_dm, retries, max_active = search_settings()
+    watermarks = get_watermarks()
+    sources = enabled_sources()
+    started = datetime.now(timezone.utc)
+
+    since = watermarks.since(keywords, sources)
+    results, failures = await search_sources(keywords, concurrent_pm, concurrent_ss, concurrent_dm, retries, priorities, max_active, since=since)
+    new_ids = await merge_to_db(results)
+    watermarks.advance(keywords, sources, started, failures)
+
+    return results, new_ids
 
 
 async def process_document(session, processor, doc):
     url = doc["pdf_url"]
 
-    processed_data = await processor.process_pdf(
-        session,
-        url, ["introduction", "results", "conclusion"])
+    with stage("ai.document", url=url):
+        processed_data = await processor.process_pdf(
+            session,
+            url, ["introduction", "results", "conclusion"],
+            # A combined extraction of this document was truncated in a batch before
+            "separate" if doc.get("ai_truncated") else None)
     new_values = {
         "markdown_sections": processed_data["markdown_sections"],
         "introduction": processed_data["introduction"],
@@ -77,38 +165,89 @@ async def process_document(session, processor, doc):
         "tables": processed_data["tables"],
         "ai_processed": processed_data["ai_processing"]
     }
+    if processed_data.get("page_count"):
+        new_values["page_count"] = processed_data["page_count"]
+    if processed_data["ai_processing"].startswith("failed"):
+        new_values.update(failed_attempt(doc, processed_data["ai_processing"]))
 
     return doc["_id"], new_values
 
 
+async def save_ai_results(collection, field_store, doc, new_values):
+    doc_id = doc["_id"]
+    # The index gets the full text, the collection only keeps a preview of offloaded fields
+    indexed = {**doc, **new_values}
+    new_values = await field_store.offload(doc_id, new_values)
+    with stage("cosmos.update", document=str(doc_id)):
+        result = collection.update_one(
+            {"_id": doc_id}, {"$set": new_values, "$unset": {"ai_locked_at": ""}})
+    if result.modified_count == 1:
+        logging.info(f'Updated document: {doc_id}')
+        index_documents([indexed])
+    else:
+        logging.warning(
+            f'Failed to update document for some reason: {doc_id}')
+
+
 @app.route(route="Search", auth_level=func.AuthLevel.ANONYMOUS)
-async def Search(req: func.HttpRequest) -> func.HttpResponse:
+@app.queue_output(arg_name="searchqueue", queue_name=SEARCH_QUEUE, connection=QUEUE_CONNECTION)
+@profile_function("Search")
+async def Search(req: func.HttpRequest, searchqueue: func.Out[typing.List[str]]) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
-    concurrent_pm = os.environ.get("CONCURRENT_PUBMED", 10)
-    concurrent_ss = os.environ.get("CONCURRENT_SEMANTIC_SCHOLAR", 50)
-    concurrent_dm = os.environ.get("CONCURRENT_DYNAMED", 10)
-    retries = os.environ.get("SOURCE_RETRIES", 3)
+    mode = req.params.get('mode') or os.environ.get("SEARCH_MODE", "inline")
+    refresh = req.params.get('refresh', '').lower() in ('1', 'true', 'yes')
+    concurrent_pm, concurrent_ss, concurrent_dm, retries, max_active = search_settings()
 
     request_id = f'SEARCH ({datetime.now().isoformat()})'
 
-    keywords = req.params.get('keywords')
-    if not keywords:
-        try:
-            req_body = req.get_json()
-        except ValueError:
-            pass
-        else:
-            keywords = req_body.get('keywords')
+    try:
+        req_body = req.get_json()
+    except ValueError:
+        req_body = {}
+    if not isinstance(req_body, dict):
+        return func.HttpResponse("The request body must be a JSON object", status_code=400)
+
+    keywords = req.params.get('keywords') or req_body.get('keywords')
+    if keywords is not None and not isinstance(keywords, str):
+        return func.HttpResponse("keywords must be a comma separated string", status_code=400)
+    priorities = req_body.get('priorities', {})
+    # bool is an int too, but true/false is not a priority
+    if not isinstance(priorities, dict) or not all(
+            isinstance(priority, int) and not isinstance(priority, bool) for priority in priorities.values()):
+        return func.HttpResponse("priorities must be an object of keywords to integers", status_code=400)
+
+    keywords = normalize_keywords(keywords.split(',')) if keywords else []
+    priorities = {canonical_keyword(keyword): priority for keyword, priority in priorities.items()}
 
     if keywords:
         try:
-            keywords = keywords.split(',')
             request_id = f'{request_id} - {keywords}'
             logging.info(f'{request_id} - Starting')
 
-            results = await search(keywords, concurrent_pm, concurrent_ss, concurrent_dm, retries)
-            await save_to_db(results)
-            return func.HttpResponse(f"Got: '{keywords} with {len(results)} results'. This HTTP triggered function executed successfully.")
+            claims = get_claims()
+            keywords, busy = claims.claim_many(keywords, hold=(mode == "queue"))
+            if busy:
+                logging.info(f'{request_id} - Skipping keywords searched elsewhere: {busy}')
+            if not keywords:
+                return func.HttpResponse(f"Already being searched: '{busy}'.", status_code=409)
+
+            if mode == "queue":
+                messages = list(search_messages(keywords))
+                searchqueue.set(messages)
+                return func.HttpResponse(f"Queued: '{keywords}' as {len(messages)} search requests (skipped: {busy}).", status_code=202)
+
+            try:
+                with stage("search.request", keywords=len(keywords), refresh=refresh):
+                    if refresh:
+                        results, _ = await refresh_keywords(keywords, priorities)
+                    else:
+                        started = datetime.now(timezone.utc)
+                        results, failures = await search_sources(keywords, concurrent_pm, concurrent_ss, concurrent_dm, retries, priorities, max_active)
+                        await save_to_db(results)
+                        get_watermarks().advance(keywords, enabled_sources(), started, failures)
+            finally:
+                claims.release_many(keywords)
+            return func.HttpResponse(f"Got: '{keywords} with {len(results)} results' (skipped: {busy}). This HTTP triggered function executed successfully.")
         except Exception as e:
             logging.error(f'An error occured: {str(e)}')
             return func.HttpResponse(f"An error occured: {str(e)}", status_code=500)
@@ -126,6 +265,59 @@ async def Health(req: func.HttpRequest) -> func.HttpResponse:
     return func.HttpResponse("OK", status_code=200)
 
 
+@app.route(route="Query", auth_level=func.AuthLevel.ANONYMOUS)
+async def Query(req: func.HttpRequest) -> func.HttpResponse:
+    params = dict(req.params)
+    try:
+        body = req.get_json()
+    except ValueError:
+        body = {}
+    if not isinstance(body, dict):
+        return func.HttpResponse("The request body must be a JSON object", status_code=400)
+    params.update(body)
+
+    try:
+        filters = parse_filters(params)
+        page = int(params.get('page', 1))
+        page_size = min(int(params.get('page_size', 10)), 100)
+        fields = params.get('fields')
+        if isinstance(fields, str):
+            fields = fields.split(',')
+    except ValueError as e:
+        return func.HttpResponse(f"Invalid query parameter: {str(e)}", status_code=400)
+
+    try:
+        index = shared_index(get_collection())
+
+        start = datetime.now()
+        with stage("query.search", page=page, page_size=page_size):
+            response = index.search(params.get('q', ''), filters, page, page_size, fields)
+        # The AI fields are not kept in the index, they are read from the collection (and blob
+        # storage when offloaded) only when asked for
+        requested = [field for field in fields or [] if field in OFFLOAD_FIELDS]
+        if requested:
+            response["results"] = await load_ai_fields(response["results"], requested)
+        response["took_ms"] = round((datetime.now() - start).total_seconds() * 1000, 2)
+
+        return func.HttpResponse(json.dumps(response, default=str), mimetype="application/json")
+    except Exception as e:
+        logging.error(f'An error occured: {str(e)}')
+        return func.HttpResponse(f"An error occured: {str(e)}", status_code=500)
+
+
+async def load_ai_fields(results, fields):
+    """
+    Adds the full values of fields to the query results.
+    """
+    field_store = FieldStore(registry.blob_service())
+    # The index keeps ids as strings
+    ids = [ObjectId(r["_id"]) if ObjectId.is_valid(r["_id"]) else r["_id"] for r in results]
+    with stage("query.load_fields", documents=len(results)):
+        docs = {str(doc["_id"]): doc for doc in get_collection().find({"_id": {"$in": ids}}, fields)}
+        loaded = await asyncio.gather(*(field_store.load(docs.get(r["_id"], {}), fields) for r in results))
+    return [{**result, **{field: doc.get(field) for field in fields}} for result, doc in zip(results, loaded)]
+
+
 @app.route(route="Delete", auth_level=func.AuthLevel.ANONYMOUS)
 async def Delete(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Delete request recieved.')
@@ -142,8 +334,11 @@ async def Delete(req: func.HttpRequest) -> func.HttpResponse:
     if keywords:
         try:
             keywords = keywords.split(',')
-            for keyword in keywords:
-                delete_keyword(keyword)
+            # documents stored before keywords were normalized keep their original spelling
+            keywords = list(dict.fromkeys([keyword.strip() for keyword in keywords] + normalize_keywords(keywords)))
+            logging.info(f"Deleting keywords: {keywords} from DB")
+            delete_keywords(get_collection(), keywords)
+            invalidate_index()
             return func.HttpResponse(f"Deleted: '{keywords}'. This HTTP triggered function executed successfully.")
         except Exception as e:
             logging.error(f'An error occured: {str(e)}')
@@ -160,9 +355,8 @@ async def ClearDatabase(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Clear Database request recieved.')
 
     try:
-        client, collection = get_db_connection()
-        collection.delete_many({})
-        client.close()
+        clear_collection(get_collection())
+        invalidate_index()
     except Exception as e:
         logging.error(f'An error occured: {str(e)}')
         return func.HttpResponse(f"An error occured: {str(e)}", status_code=500)
@@ -173,6 +367,7 @@ async def ClearDatabase(req: func.HttpRequest) -> func.HttpResponse:
 
 @app.function_name(name="updateAI")
 @app.timer_trigger(schedule="0 * * * * *", arg_name="updateAI", run_on_startup=False)
+@profile_function("UpdateAI")
 async def UpdateAI(updateAI: func.TimerRequest) -> None:
     id = uuid.uuid4()
 
@@ -184,51 +379,159 @@ async def UpdateAI(updateAI: func.TimerRequest) -> None:
         logger.info(f'DB AI Update timer is past due! ({id})')
 
     logger.info('DB AI Update timer is starting')
-    batch_size = os.environ.get("COSMOS_AI_BATCH_SIZE", 15)
-    batch_size = int(batch_size)
-    logger.info(f'Only processing first {batch_size} documents')
+
+    from ai.processor import PDFProcessor
 
     processor = PDFProcessor()
-    client, collection = get_db_connection()
+    collection = get_collection()
+    field_store = FieldStore(processor.blob_service_client)
+    session = registry.http_session("pdf")
+
+    async def work(doc):
+        _, new_values = await process_document(session, processor, doc)
+        await save_ai_results(collection, field_store, doc, new_values)
 
     try:
-        cursor = collection.find({'ai_processed': False}, limit=batch_size)
-        docs = cursor.to_list()
+        lock_ttl = timedelta(seconds=int(os.environ.get("AI_LOCK_TTL_SECONDS", 1800)))
+        recovered = recover_stale_locks(collection, lock_ttl)
+        if recovered:
+            logger.warning(f'Released {recovered} documents with stale locks')
+
+        scheduler = AIBatchScheduler(collection, id)
+        logger.info(f'Processing documents by {scheduler.priority} for up to {scheduler.budget}s')
+
+        with stage("ai.batch", budget=scheduler.budget):
+            processed = await scheduler.run(session, work)
 
-        if len(docs) == 0:
+        if processed == 0 and not scheduler.released:
             logger.info(f'No documents to process')
             return
 
-        logger.info(f'Found {len(docs)} documents to process')
+        logger.info(f'Processed {processed} documents, released {len(scheduler.released)} at the deadline')
 
-        logger.info('Locking documents for processing')
-        for doc in docs:
-            doc_id = doc["_id"]
-            result = collection.update_one(
-                {"_id": doc_id}, {"$set": {"ai_processed": f'processing ({id})'}})
-            if result.modified_count == 1:
-                logger.info(f'Locked document: {doc_id}')
-            else:
-                logger.warning(
-                    f'Failed to lock document for some reason: {doc_id}')
-        logger.info('Document locking complete')
+    except Exception as e:
+        logger.error(f'An error occured: {str(e)}')
 
-        results = []
 
-        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=600)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            results = await asyncio.gather(*(process_document(session, processor, doc) for doc in docs))
+@app.function_name(name="AIBatch")
+@app.timer_trigger(schedule="0 */15 * * * *", arg_name="batchTimer", run_on_startup=False)
+@profile_function("AIBatch")
+async def AIBatch(batchTimer: func.TimerRequest) -> None:
+    if os.environ.get("AI_BATCH_ENABLED", "").lower() not in ("1", "true", "yes"):
+        return
 
-        for doc_id, new_values in results:
-            result = collection.update_one(
-                {"_id": doc_id}, {"$set": new_values})
-            if result.modified_count == 1:
-                logger.info(f'Updated document: {doc_id}')
-            else:
-                logger.warning(
-                    f'Failed to update document for some reason: {doc_id}')
+    from ai.batch import BatchJobs, batch_backend
+    from ai.processor import PDFProcessor
+
+    processor = PDFProcessor()
+    collection = get_collection()
+    field_store = FieldStore(processor.blob_service_client)
+    jobs = BatchJobs(
+        collection,
+        registry.collection(os.environ.get("COSMOS_AI_BATCHES_COLLECTION_NAME", "ai_batches")),
+        processor,
+        batch_backend())
+
+    async def save(doc, new_values):
+        await save_ai_results(collection, field_store, doc, new_values)
+
+    try:
+        saved = await jobs.ingest(save)
+        if saved:
+            logging.info(f'Saved {saved} documents from finished batches')
+
+        # Batches are for backfills, a small backlog is left to UpdateAI
+        backlog = collection.count_documents({"ai_processed": False})
+        min_backlog = int(os.environ.get("AI_BATCH_MIN_BACKLOG", 500))
+        max_pending = int(os.environ.get("AI_BATCH_MAX_PENDING", 2))
+        if backlog < min_backlog or jobs.pending() >= max_pending:
+            logging.info(f'Not submitting a batch (backlog: {backlog}, pending batches: {jobs.pending()})')
+            return
 
+        job_id = await jobs.submit(registry.http_session("pdf"), int(os.environ.get("AI_BATCH_SIZE", 100)), save)
+        if job_id:
+            logging.info(f'Submitted batch job {job_id}')
     except Exception as e:
-        logger.error(f'An error occured: {str(e)}')
+        logging.error(f'An error occured: {str(e)}')
+
+
+@app.function_name(name="SearchWorker")
+@app.queue_trigger(arg_name="msg", queue_name=SEARCH_QUEUE, connection=QUEUE_CONNECTION)
+@app.queue_output(arg_name="searchqueue", queue_name=SEARCH_QUEUE, connection=QUEUE_CONNECTION)
+@app.queue_output(arg_name="aiqueue", queue_name=AI_QUEUE, connection=QUEUE_CONNECTION)
+@profile_function("SearchWorker")
+async def SearchWorker(msg: func.QueueMessage, searchqueue: func.Out[str], aiqueue: func.Out[typing.List[str]]) -> None:
+    message = msg.get_body().decode('utf-8')
+    logging.info(f'Search request recieved: {message} (dequeue count: {msg.dequeue_count})')
+
+    results, follow_up = await run_search_message(message, registry.http_session("search"))
+
+    inserted_ids = await save_to_db(results)
+
+    if follow_up:
+        searchqueue.set(follow_up)
+
+    pending = [str(doc_id) for doc_id, doc in zip(inserted_ids, results) if doc["ai_processed"] is False]
+    if pending:
+        aiqueue.set([json.dumps({"id": doc_id}) for doc_id in pending])
+
+    logging.info(f'Search request completed with {len(results)} results, {len(pending)} queued for AI processing')
+
+
+@app.function_name(name="AIWorker")
+@app.queue_trigger(arg_name="msg", queue_name=AI_QUEUE, connection=QUEUE_CONNECTION)
+@profile_function("AIWorker")
+async def AIWorker(msg: func.QueueMessage) -> None:
+    doc_id = ObjectId(json.loads(msg.get_body().decode('utf-8'))["id"])
+
+    collection = get_collection()
+
+    doc = lock_document(collection, doc_id, msg.id)
+    if doc is None:
+        logging.info(f'Document already processed or locked: {doc_id}')
+        return
+
+    from ai.processor import PDFProcessor
+
+    try:
+        processor = PDFProcessor()
+        _, new_values = await process_document(registry.http_session("pdf"), processor, doc)
+        indexed = {**doc, **new_values}
+
+        new_values = await FieldStore(processor.blob_service_client).offload(doc_id, new_values)
+
+        with stage("cosmos.update", document=str(doc_id)):
+            collection.update_one({"_id": doc_id}, {"$set": new_values, "$unset": {"ai_locked_at": ""}})
+    except Exception:
+        # Unlock before the queue retries the message, or the retry finds it locked and gives up
+        release_document(collection, doc_id, msg.id)
+        raise
+
+    index_documents([indexed])
+    logging.info(f'Updated document: {doc_id}')
+
+
+@app.function_name(name="RefreshKeywords")
+@app.timer_trigger(schedule="0 0 */6 * * *", arg_name="refreshTimer", run_on_startup=False)
+@profile_function("RefreshKeywords")
+async def RefreshKeywords(refreshTimer: func.TimerRequest) -> None:
+    max_age = timedelta(hours=int(os.environ.get("REFRESH_MIN_AGE_HOURS", 24)))
+    limit = int(os.environ.get("REFRESH_BATCH_SIZE", 100))
+
+    keywords = get_watermarks().stale_keywords(max_age, limit)
+    if not keywords:
+        logging.info('No keywords due for a refresh')
+        return
+
+    claims = get_claims()
+    keywords, busy = claims.claim_many(keywords)
+    logging.info(f'Refreshing {len(keywords)} keywords (skipped, searched elsewhere: {busy})')
+
+    try:
+        with stage("search.refresh", keywords=len(keywords)):
+            results, new_ids = await refresh_keywords(keywords)
+        logging.info(f'Refresh completed with {len(results)} results, {len(new_ids)} new documents')
+    except Exception as e:
+        logging.error(f'An error occured: {str(e)}')
     finally:
-        client.close()
+        claims.release_many(keywords)
@@ -0,0 +1,203 @@
+import gzip
+import heapq
+import json
+import math
+import re
+from collections import Counter, defaultdict
+
+from searchlib.keywords import canonical_keyword
+
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+YEAR_RE = re.compile(r"\b(\d{4})\b")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it", "of",
+    "on", "or", "that", "the", "this", "to", "was", "were", "with",
+}
+
+# Searched fields, the AI sections are only there once UpdateAI has run (or as previews when offloaded)
+TEXT_FIELDS = ["title", "abstract", "keywords", "introduction", "results", "conclusion"]
+
+# Kept in memory for filtering and for building responses without a database round trip
+STORED_FIELDS = ["source", "searchkey", "title", "abstract", "keywords", "citations", "pdf_url", "metadata", "ai_processed"]
+
+FILTERS = ["searchkey", "source", "year_from", "year_to", "min_citations", "max_citations"]
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def field_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value if value != "NA" else ""
+    if isinstance(value, list):
+        return " ".join(field_text(v) for v in value)
+    if isinstance(value, dict):
+        # Offloaded fields keep a preview of their text. Writes are indexed before offloading, so
+        # only an index rebuilt from the collection is limited to the preview
+        return field_text(value.get("preview"))
+    return str(value)
+
+
+def document_year(doc):
+    metadata = doc.get("metadata") or {}
+    for value in (metadata.get("published_year"), metadata.get("published_date")):
+        match = YEAR_RE.search(str(value or ""))
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def parse_filters(params):
+    """
+    Turns request/CLI parameters into index filters, ignoring anything that is not a filter.
+    """
+    filters = {}
+    for name in FILTERS:
+        value = params.get(name)
+        if value in (None, ""):
+            continue
+        if name in ("searchkey", "source"):
+            filters[name] = value.split(",") if isinstance(value, str) else list(value)
+            if name == "searchkey":
+                filters[name] = [canonical_keyword(keyword) for keyword in filters[name]]
+        else:
+            filters[name] = int(value)
+    return filters
+
+
+class InvertedIndex:
+    """
+    In-memory BM25 index over the collected results. Documents can be added, replaced and
+    removed one at a time so the index can follow writes to the collection.
+    """
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.lengths = {}
+        self.docs = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc):
+        doc_id = str(doc["_id"])
+        self.remove(doc_id)
+
+        terms = Counter(tokenize(" ".join(field_text(doc.get(field)) for field in TEXT_FIELDS)))
+        for term, count in terms.items():
+            self.postings[term][doc_id] = count
+
+        length = sum(terms.values())
+        self.lengths[doc_id] = length
+        self.total_length += length
+
+        stored = {field: doc.get(field) for field in STORED_FIELDS if field in doc}
+        stored["_id"] = doc_id
+        stored["year"] = document_year(doc)
+        stored["terms"] = list(terms)
+        self.docs[doc_id] = stored
+
+    def remove(self, doc_id):
+        doc_id = str(doc_id)
+        stored = self.docs.pop(doc_id, None)
+        if stored is None:
+            return
+
+        for term in stored["terms"]:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(doc_id)
+
+    def _matches(self, doc, filters):
+        # Documents stored before keywords were canonicalized keep their original spelling
+        if "searchkey" in filters and canonical_keyword(doc.get("searchkey") or "") not in filters["searchkey"]:
+            return False
+        if "source" in filters and doc.get("source") not in filters["source"]:
+            return False
+        year = doc.get("year")
+        if "year_from" in filters and (year is None or year < filters["year_from"]):
+            return False
+        if "year_to" in filters and (year is None or year > filters["year_to"]):
+            return False
+        citations = doc.get("citations") or 0
+        if "min_citations" in filters and citations < filters["min_citations"]:
+            return False
+        if "max_citations" in filters and citations > filters["max_citations"]:
+            return False
+        return True
+
+    def _scores(self, terms, filters):
+        scores = defaultdict(float)
+        count = len(self.docs)
+        average_length = self.total_length / count if count else 0
+
+        for term in set(terms):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                if filters and not self._matches(self.docs[doc_id], filters):
+                    continue
+                norm = 1 - self.b + self.b * self.lengths[doc_id] / (average_length or 1)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * norm)
+
+        return scores
+
+    def search(self, query, filters=None, page=1, page_size=10, fields=None):
+        """
+        Returns one page of results ordered by BM25 score. Without query terms the filtered
+        documents are ordered by citations instead. fields limits what is returned per result.
+        """
+        filters = filters or {}
+        terms = tokenize(query or "")
+        page = max(page, 1)
+        limit = page * page_size
+
+        if terms:
+            scores = self._scores(terms, filters)
+            total = len(scores)
+            ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        else:
+            matching = [doc for doc in self.docs.values() if self._matches(doc, filters)]
+            total = len(matching)
+            top = heapq.nlargest(limit, matching, key=lambda doc: doc.get("citations") or 0)
+            ranked = [(doc["_id"], None) for doc in top]
+
+        results = []
+        for doc_id, score in ranked[limit - page_size:]:
+            doc = self.docs[doc_id]
+            projected = {field: doc.get(field) for field in (fields or STORED_FIELDS + ["year"]) if field in doc}
+            projected["_id"] = doc_id
+            if score is not None:
+                projected["score"] = round(score, 4)
+            results.append(projected)
+
+        return {"total": total, "page": page, "page_size": page_size, "results": results}
+
+    def save(self, path):
+        # JSON rather than pickle, loading the file must not be able to run code. Values JSON has
+        # no type for (dates, ids in metadata) come back as strings, as they are in responses
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(self.__dict__, f, default=str)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            state = json.load(f)
+        index = cls(state["k1"], state["b"])
+        index.postings.update(state["postings"])
+        index.lengths = state["lengths"]
+        index.docs = state["docs"]
+        index.total_length = state["total_length"]
+        return index
@@ -0,0 +1,84 @@
+import logging
+import os
+import tempfile
+import time
+
+from telemetry.otel import cache_hits_counter, stage
+from .index import InvertedIndex, STORED_FIELDS, TEXT_FIELDS
+
+
+_index = None
+_built_at = 0
+
+PROJECTION = {field: 1 for field in set(STORED_FIELDS + TEXT_FIELDS)}
+
+
+def _index_path():
+    return os.environ.get("QUERY_INDEX_PATH", os.path.join(tempfile.gettempdir(), "medical-search-index.json.gz"))
+
+
+def build_index(docs):
+    index = InvertedIndex()
+    for doc in docs:
+        index.add(doc)
+    return index
+
+
+def shared_index(collection):
+    """
+    Returns the index for this worker process. It is loaded from QUERY_INDEX_PATH if a recent
+    enough copy is there, otherwise rebuilt from the collection. Writes made by this process are
+    applied incrementally through index_documents, and the index is rebuilt once it is older than
+    QUERY_INDEX_MAX_AGE seconds to pick up writes from other instances.
+    """
+    global _index, _built_at
+    max_age = int(os.environ.get("QUERY_INDEX_MAX_AGE", 3600))
+    path = _index_path()
+
+    if _index is None and os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age:
+        try:
+            with stage("query.load_index"):
+                _index = InvertedIndex.load(path)
+                _built_at = os.path.getmtime(path)
+            logging.info(f"Loaded query index with {len(_index)} documents from {path}")
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Could not load query index from {path}, rebuilding it: {e}")
+            _index = None
+
+    if _index is not None and time.time() - _built_at < max_age:
+        cache_hits_counter.add(1, {"cache": "query_index"})
+        return _index
+
+    with stage("query.build_index"):
+        _index = build_index(collection.find({}, PROJECTION))
+        _built_at = time.time()
+        try:
+            _index.save(path)
+        except OSError as e:
+            logging.warning(f"Could not save query index to {path}: {e}")
+    logging.info(f"Built query index with {len(_index)} documents")
+
+    return _index
+
+
+def index_documents(docs):
+    """
+    Applies written documents to the index, if this process has one loaded.
+    """
+    if _index is None:
+        return
+    for doc in docs:
+        if "_id" in doc:
+            _index.add(doc)
+
+
+def invalidate_index():
+    """
+    Drops the in-memory and saved index so the next query rebuilds it, used after deletes.
+    """
+    global _index
+    _index = None
+    try:
+        os.remove(_index_path())
+    except FileNotFoundError:
+        pass
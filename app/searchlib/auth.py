@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import time
+
+from telemetry.otel import cache_hits_counter, record_response, stage
+
+
+class TokenProvider:
+    """
+    OAuth2 client credentials tokens, cached until shortly before they expire. When many
+    searches find the token expired at once only one of them refreshes it, the others wait
+    for that refresh and reuse the result.
+    """
+    def __init__(self, name, token_url, client_id, client_secret, scope=None, refresh_margin=60):
+        self.name = name
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._refresh_at = 0
+        self._lock = asyncio.Lock()
+
+    def _valid(self):
+        return self._token is not None and time.monotonic() < self._refresh_at
+
+    async def _refresh(self, session):
+        data = {
+            'grant_type': 'client_credentials',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+        }
+        if self.scope:
+            data['scope'] = self.scope
+
+        with stage("auth.token_refresh", source=self.name):
+            async with session.post(self.token_url, data=data) as resp:
+                record_response(f'{self.name}.auth', resp.status)
+                resp.raise_for_status()
+                response = await resp.json()
+
+        expires_in = int(response.get('expires_in', 3600))
+        # Short-lived tokens would otherwise be due for a refresh as soon as they arrive
+        margin = min(self.refresh_margin, expires_in / 2)
+        self._token = response['access_token']
+        self._refresh_at = time.monotonic() + expires_in - margin
+        logging.info(f"Refreshed {self.name} access token (expires in {expires_in}s)")
+
+    async def get_token(self, session):
+        if self._valid():
+            cache_hits_counter.add(1, {"cache": f"token.{self.name}"})
+            return self._token
+
+        async with self._lock:
+            # another caller may have refreshed while we were waiting for the lock
+            if not self._valid():
+                await self._refresh(session)
+            return self._token
+
+    async def invalidate(self, token):
+        """
+        Drops token after the server rejected it. Only the token that was actually rejected is
+        dropped, so a burst of 401s for the same token leads to a single refresh.
+        """
+        async with self._lock:
+            if self._token == token:
+                self._token = None
+                self._refresh_at = 0
@@ -0,0 +1,43 @@
+import asyncio
+import json
+
+from telemetry.otel import cache_hits_counter
+
+
+class SingleFlight:
+    """
+    Shares one call between everyone asking for the same key while it is in flight. Callers
+    that arrive while the call is running get its result (or exception) instead of starting
+    their own. Nothing is kept once the call completes.
+    """
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, factory):
+        task = self._inflight.get(key)
+        if task is not None:
+            cache_hits_counter.add(1, {"cache": "singleflight"})
+        else:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # shielded so a cancelled caller does not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+
+_searches = SingleFlight()
+
+
+async def coalesced_search(client, searchkey, token=None):
+    """
+    client.search(searchkey, token), shared with any identical search already running in this
+    process. Clients that change their results through options set a variant to keep them apart.
+    """
+    key = (
+        client.__class__.__name__,
+        getattr(client, "variant", ""),
+        searchkey,
+        json.dumps(token, sort_keys=True, default=str),
+    )
+    return await _searches.do(key, lambda: client.search(searchkey) if token is None else client.search(searchkey, token))
@@ -1,15 +1,57 @@
+import logging
+import os
+
+from telemetry.otel import record_response, stage
+from .auth import TokenProvider
 from .results import Redo, Success
 
 
+_token_provider = None
+
+
+def default_token_provider():
+    """
+    The token provider shared by every Dynamed client in the process, so the cached token
+    outlives a single search.
+    """
+    global _token_provider
+    if _token_provider is None:
+        _token_provider = TokenProvider(
+            "Dynamed",
+            os.environ.get("DYNAMED_TOKEN_URL"),
+            os.environ.get("DYNAMED_CLIENT_ID"),
+            os.environ.get("DYNAMED_CLIENT_SECRET"),
+            os.environ.get("DYNAMED_SCOPE"),
+            int(os.environ.get("DYNAMED_TOKEN_REFRESH_MARGIN", 60)),
+        )
+    return _token_provider
+
+
 class Dynamed:
-    def __init__(self, session):
-        self.base_url = "https://apis.ebsco.com/medsapi-dynamed/v2/content/search"
+    def __init__(self, session, token_provider=None):
+        self.base_url = os.environ.get("DYNAMED_BASE_URL", "https://apis.ebsco.com/medsapi-dynamed/v2/content/search")
         self.headers = {
             "Content-Type": "application/json",
             "Accept": "application/json",
-            "Authorization": "Bearer TOKEN"
         }
         self.session = session
+        self.token_provider = token_provider or default_token_provider()
+
+    @staticmethod
+    def enabled():
+        return all(os.environ.get(setting) for setting in ("DYNAMED_TOKEN_URL", "DYNAMED_CLIENT_ID", "DYNAMED_CLIENT_SECRET"))
+
+    async def _get(self, params):
+        access_token = await self.token_provider.get_token(self.session)
+        headers = {**self.headers, "Authorization": f"Bearer {access_token}"}
+
+        async with self.session.get(self.base_url, json=params, headers=headers) as resp:
+            body = await resp.read()
+            record_response(self.__class__.__name__, resp.status, len(body))
+            response = await resp.json(content_type=None) if body else {}
+            if resp.status == 401 or response.get('name', '') == 'Unauthorized':
+                return access_token, None
+            return access_token, response
 
     async def search(self, searchkey, token={}):
         params = {
@@ -17,26 +59,40 @@ class Dynamed:
             'fields': ['title'],
         }
 
-        async with self.session.get(self.base_url, json=params, headers=self.headers) as resp:
-            response = await resp.json()
-            if response.get('name', '') == 'Unauthorized':
+        with stage("dynamed.search", source=self.__class__.__name__, searchkey=searchkey):
+            try:
+                access_token, response = await self._get(params)
+                if response is None:
+                    # the token was rejected before it expired, refresh it and try once more
+                    logging.info(f"Dynamed rejected the access token, refreshing ({searchkey})")
+                    await self.token_provider.invalidate(access_token)
+                    _, response = await self._get(params)
+            except Exception as e:
+                logging.error(f"Error: {self.__class__.__name__}({searchkey}) - {e}")
                 return Redo(searchkey, self, token)
-            
-            result = []
-            
-            for data in response.get('data', []):
-                result.append(Success(
-                    searchkey=searchkey,
-                    published_year=data.get('publicationDate', ''),
-                    published_date=data.get('year', ''),
-                    authors=[author.get('name', '') for author in data.get('authors', [])],
-                    keywords=[],
-                    title=data.get('title', ''),
-                    abstract=data.get('abstract', 'NA'),
-                    introduction='NA',
-                    results='NA',
-                    conclusion='NA',
-                    figures=[]
-                ))
-
-            return result
+
+        if response is None:
+            return Redo(searchkey, self, token)
+
+        result = []
+
+        for data in response.get('data', []):
+            result.append(Success(
+                source=self.__class__.__name__,
+                searchkey=searchkey,
+                published_year=data.get('year', ''),
+                published_date=data.get('publicationDate', ''),
+                authors=[author.get('name', '') for author in data.get('authors', [])],
+                keywords=[],
+                citations=0,
+                title=data.get('title', ''),
+                abstract=data.get('abstract', 'NA'),
+                introduction='NA',
+                results='NA',
+                conclusion='NA',
+                figures=[],
+                pdf_url='',
+                external_id=data.get('id', ''),
+            ))
+
+        return result
@@ -0,0 +1,20 @@
+def canonical_keyword(keyword):
+    """
+    The form keywords are searched and stored under: surrounding and repeated whitespace
+    removed and case folded, so " Angina" and "angina" are the same search.
+    """
+    return " ".join(keyword.split()).casefold()
+
+
+def normalize_keywords(keywords):
+    """
+    Canonicalizes keywords, dropping empty entries and duplicates while keeping the order.
+    """
+    result = []
+    seen = set()
+    for keyword in keywords:
+        keyword = canonical_keyword(keyword)
+        if keyword and keyword not in seen:
+            seen.add(keyword)
+            result.append(keyword)
+    return result
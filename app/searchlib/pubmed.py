@@ -3,6 +3,7 @@ import logging
 import os
 import urllib
 import xmltodict
+from telemetry.otel import record_response, stage
 from .results import Redo, Success
 
 
@@ -29,16 +30,25 @@ class PubMed:
             'term': f'"{searchkey}"[Title:~3] AND free full text[sb]',
         }
 
-        param_str = urllib.parse.urlencode(params, safe=',"][~:')
-
-        async with self.session.get(self.base_search_url, params=param_str, headers=self.headers) as resp:
-            if resp.status != 200:
-                response = await resp.text()
-                logging.error(f"Error: {self.__class__.__name__}({searchkey}) - {response}")
-                return Redo(searchkey, self, token)
-            else:
-                response = await resp.json()
-                return response
+        # incremental refresh, only articles added to PubMed since the keyword was last synced
+        if token.get('since'):
+            params['datetype'] = 'edat'
+            params['mindate'] = token['since'].replace('-', '/')
+            params['maxdate'] = '3000'
+
+        param_str = urllib.parse.urlencode(params, safe=',"][~:/')
+
+        with stage("pubmed.esearch", source=self.__class__.__name__, searchkey=searchkey):
+            async with self.session.get(self.base_search_url, params=param_str, headers=self.headers) as resp:
+                body = await resp.read()
+                record_response(self.__class__.__name__, resp.status, len(body))
+                if resp.status != 200:
+                    response = await resp.text()
+                    logging.error(f"Error: {self.__class__.__name__}({searchkey}) - {response}")
+                    return Redo(searchkey, self, token)
+                else:
+                    response = await resp.json()
+                    return response
             
     async def _get_details(self, ids, token):
         params = {
@@ -49,36 +59,43 @@ class PubMed:
 
         param_str = urllib.parse.urlencode(params, safe=',"][~:')
 
-        async with self.session.post(self.base_details_url, params=param_str, headers=self.headers, data={'id': ','.join(ids)}) as resp:
-            if resp.status != 200:
-                if hasattr(resp, 'error'):
-                    logging.error(f"Error: {resp.error}")
-                elif hasattr(resp, 'reason'):
-                    logging.error(f"Error: {resp.reason}")
+        with stage("pubmed.efetch", source=self.__class__.__name__, ids=len(ids)):
+            async with self.session.post(self.base_details_url, params=param_str, headers=self.headers, data={'id': ','.join(ids)}) as resp:
+                if resp.status != 200:
+                    record_response(self.__class__.__name__, resp.status)
+                    if hasattr(resp, 'error'):
+                        logging.error(f"Error: {resp.error}")
+                    elif hasattr(resp, 'reason'):
+                        logging.error(f"Error: {resp.reason}")
+                    else:
+                        logging.error(f"Error: (no error or reason field found) {self.__class__.__name__}({ids}) - {resp.status}")
+                    return Redo("id", self, token)
                 else:
-                    logging.error(f"Error: (no error or reason field found) {self.__class__.__name__}({ids}) - {resp.status}")
-                return Redo("id", self, token)
-            else:
-                response = await resp.text()
-                data = xmltodict.parse(response)
-                return data
+                    response = await resp.text()
+                    record_response(self.__class__.__name__, resp.status, len(response))
+
+        with stage("pubmed.parse", source=self.__class__.__name__, size=len(response)):
+            data = xmltodict.parse(response)
+        return data
             
     async def _get_url(self, pmc_ids):
-        for pmc_id in pmc_ids:
-            url = f"https://www.ncbi.nlm.nih.gov/pmc/articles/{pmc_id}/pdf/"
-            try:
-                async with self.session.head(url) as resp:
-                    logging.debug(f"Checking {url} - {resp.status}")
-                    if resp.status == 200:
-                        return url
-                    elif resp.status == 303:
-                        location = resp.headers.get('location')
-                        return location
-            except Exception as e:
-                logging.error(f"Error: {self.__class__.__name__}({pmc_id}) - {e}")
-                continue
-                
-        return ''
+        with stage("pubmed.pdf_probe", source=self.__class__.__name__, candidates=len(pmc_ids)):
+            for pmc_id in pmc_ids:
+                url = f"https://www.ncbi.nlm.nih.gov/pmc/articles/{pmc_id}/pdf/"
+                try:
+                    async with self.session.head(url) as resp:
+                        record_response(self.__class__.__name__, resp.status)
+                        logging.debug(f"Checking {url} - {resp.status}")
+                        if resp.status == 200:
+                            return url
+                        elif resp.status == 303:
+                            location = resp.headers.get('location')
+                            return location
+                except Exception as e:
+                    logging.error(f"Error: {self.__class__.__name__}({pmc_id}) - {e}")
+                    continue
+
+            return ''
     
     async def _process_article(self, searchkey, entry):
         data = entry.get('MedlineCitation', {})
@@ -129,6 +146,7 @@ class PubMed:
                 conclusion='NA',
                 figures=[],
                 pdf_url=pdf_url[0],
+                external_id=pmc_id,
             )
 
     async def search(self, searchkey, token={}):
@@ -2,10 +2,11 @@ import json
 
 
 class Success:
-    def __init__(self, source, searchkey, published_year, published_date, authors, keywords, citations, title, abstract, introduction, results, conclusion, figures, pdf_url):
+    def __init__(self, source, searchkey, published_year, published_date, authors, keywords, citations, title, abstract, introduction, results, conclusion, figures, pdf_url, external_id=''):
         self.data = {
             "source": source,
             "searchkey": searchkey,
+            "external_id": external_id,
             "metadata": {
                 "published_year": published_year,
                 "published_date": published_date,
@@ -0,0 +1,109 @@
+import asyncio
+import itertools
+import logging
+
+from telemetry.otel import retries_counter, stage
+from .coalesce import coalesced_search
+from .results import Partial, Redo
+
+
+class Job:
+    def __init__(self, searchkey, priority=0, token=None):
+        self.searchkey = searchkey
+        self.priority = priority
+        self.token = token
+        self.attempts = 0
+
+    def __repr__(self):
+        return f"Job({self.searchkey}, {self.priority}, {self.token}, {self.attempts})"
+
+
+class SourceScheduler:
+    """
+    Runs the searches for a single source through a fixed pool of workers.
+
+    At most max_active keywords are in flight at once, so the queue never holds more than
+    max_active jobs no matter how many keywords are submitted. Follow-up pages go to the back
+    of their priority level, which gives round-robin paging across the active keywords.
+    """
+    def __init__(self, client, workers, max_active=None, retries=3):
+        self.client = client
+        self.workers = workers
+        self.max_active = max_active or workers * 2
+        self.retries = retries
+        self.queue = asyncio.PriorityQueue()
+        self.slots = asyncio.Semaphore(self.max_active)
+        self.sequence = itertools.count()
+        self.success = []
+        self.failures = []
+
+    @property
+    def name(self):
+        return self.client.__class__.__name__
+
+    def _put(self, job):
+        self.queue.put_nowait((job.priority, next(self.sequence), job))
+
+    def _finish(self):
+        self.slots.release()
+
+    async def _run(self, job):
+        logging.info(f'Querying {self.name} - {job}')
+        try:
+            with stage("search.query", source=self.name, searchkey=job.searchkey, attempt=job.attempts):
+                result = await coalesced_search(self.client, job.searchkey, job.token)
+        except Exception as e:
+            logging.error(f"Error: {self.name}({job.searchkey}) - {e}")
+            result = Redo(job.searchkey, self.client, job.token)
+
+        if isinstance(result, Redo):
+            job.attempts += 1
+            if job.attempts > self.retries:
+                logging.warning(f"Giving up on {job} after {job.attempts} attempts")
+                self.failures.append(Redo(job.searchkey, self.client, job.token))
+                self._finish()
+                return
+            retries_counter.add(1, {"source": self.name})
+            job.token = result.token
+            self._put(job)
+        elif isinstance(result, Partial):
+            self.success.extend(d.data for d in result.successes)
+            job.token = result.redo.token
+            job.attempts = 0
+            self._put(job)
+        else:
+            self.success.extend(d.data for d in result)
+            self._finish()
+
+    async def _work(self):
+        while True:
+            _, _, job = await self.queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self.queue.task_done()
+
+    async def run(self, keywords, priorities=None, since=None):
+        """
+        Searches every keyword and returns the results. since maps keywords to the date
+        (YYYY-MM-DD) to refresh them from, keywords without one are searched in full.
+        """
+        priorities = priorities or {}
+        since = since or {}
+        if priorities:
+            keywords = sorted(keywords, key=lambda keyword: priorities.get(keyword, 0))
+
+        workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        try:
+            for keyword in keywords:
+                await self.slots.acquire()
+                token = {'since': since[keyword]} if since.get(keyword) else None
+                self._put(Job(keyword, priorities.get(keyword, 0), token))
+            await self.queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        logging.info(f"{self.name} - Success: {len(self.success)}, Failures: {len(self.failures)}")
+        return self.success
@@ -3,25 +3,48 @@ import urllib
 import os
 from datetime import datetime
 
+from telemetry.otel import record_response, stage
 from .results import Partial, Redo, Success
 
+# Only the fields that end up in Success, the rest were fetched and thrown away
+FIELDS = 'title,abstract,publicationDate,authors,year,openAccessPdf,citationCount'
+
+
 class SemanticScholar:
-    def __init__(self, session):
+    def __init__(self, session, limit=None, pdf_only=None):
         self.base_url = "https://api.semanticscholar.org/graph/v1/paper/search/bulk"
         self.key = os.environ.get('SS_API_KEY')
         self.session = session
+        # results are sorted by citations, so capping the count keeps the most cited papers
+        self.limit = limit if limit is not None else int(os.environ.get('SS_MAX_RESULTS', 0)) or None
+        if pdf_only is None:
+            pdf_only = os.environ.get('SS_PDF_ONLY', '').lower() in ('1', 'true', 'yes')
+        self.pdf_only = pdf_only
+        # searches with different options must not be coalesced with each other
+        self.variant = f'{self.limit}:{self.pdf_only}'
 
     async def search(self, searchkey, token=None):
         current_year = datetime.now().year
 
+        # the token carries the continuation token from the API and how many results we already have
+        token = token or {}
+        if isinstance(token, str):
+            token = {'token': token}
+        fetched = token.get('fetched', 0)
+
         params = {
             'query': f'"{searchkey}"',
-            'fields': 'title,abstract,publicationDate,authors,year,influentialCitationCount,openAccessPdf,citationCount,publicationTypes,fieldsOfStudy,s2FieldsOfStudy',
+            'fields': FIELDS,
             'year': f'{current_year-10}-{current_year}',
             'sort': 'citationCount:desc',
         }
-        if token:
-            params['token'] = token
+        # incremental refresh, only papers published since the keyword was last synced
+        if token.get('since'):
+            params['publicationDateOrYear'] = f"{token['since']}:"
+        if self.pdf_only:
+            params['openAccessPdf'] = ''
+        if token.get('token'):
+            params['token'] = token['token']
 
         headers = {}
 
@@ -29,36 +52,46 @@ class SemanticScholar:
             headers['X-API-KEY'] = self.key
             logging.debug("Using API key for Semantic Scholar")
 
-        param_str = urllib.parse.urlencode(params, safe=',"')
-
-        async with self.session.get(self.base_url, params=param_str, headers=headers) as resp:
-            response = await resp.json()
-            if response.get('code', 0) == '429':
-                return Redo(searchkey, self, token)
-            
-            result = []
-            
-            for data in response.get('data', []):
-                result.append(Success(
-                    source=self.__class__.__name__,
-                    searchkey=searchkey,
-                    published_year=data.get('publicationDate', ''),
-                    published_date=data.get('year', ''),
-                    authors=[author.get('name', '') for author in data.get('authors', [])],
-                    keywords=[],
-                    citations=data.get('citationCount', 0),
-                    title=data.get('title', ''),
-                    abstract=data.get('abstract', 'NA'),
-                    introduction='NA',
-                    results='NA',
-                    conclusion='NA',
-                    figures=[],
-                    pdf_url=(data.get('openAccessPdf', {}) or {}).get('url', ''),
-                ))
-
-            if response.get('token'):
-                token = response.get('token')
-                redo = Redo(searchkey, self, token)
-                result = Partial(result, redo)
-
-            return result
\ No newline at end of file
+        param_str = urllib.parse.urlencode(params, safe=',":')
+
+        with stage("semantic_scholar.search", source=self.__class__.__name__, searchkey=searchkey, continuation=bool(token.get('token'))):
+            async with self.session.get(self.base_url, params=param_str, headers=headers) as resp:
+                body = await resp.read()
+                record_response(self.__class__.__name__, resp.status, len(body))
+                response = await resp.json()
+        if response.get('code', 0) == '429':
+            return Redo(searchkey, self, token)
+
+        result = []
+
+        data_list = response.get('data', [])
+        if self.limit:
+            data_list = data_list[:max(self.limit - fetched, 0)]
+
+        for data in data_list:
+            result.append(Success(
+                source=self.__class__.__name__,
+                searchkey=searchkey,
+                published_year=data.get('publicationDate', ''),
+                published_date=data.get('year', ''),
+                authors=[author.get('name', '') for author in data.get('authors', [])],
+                keywords=[],
+                citations=data.get('citationCount', 0),
+                title=data.get('title', ''),
+                abstract=data.get('abstract', 'NA'),
+                introduction='NA',
+                results='NA',
+                conclusion='NA',
+                figures=[],
+                pdf_url=(data.get('openAccessPdf', {}) or {}).get('url', ''),
+                external_id=data.get('paperId', ''),
+            ))
+
+        fetched += len(result)
+
+        if response.get('token') and not (self.limit and fetched >= self.limit):
+            token = {**token, 'token': response.get('token'), 'fetched': fetched}
+            redo = Redo(searchkey, self, token)
+            result = Partial(result, redo)
+
+        return result
\ No newline at end of file
@@ -0,0 +1,59 @@
+import json
+import logging
+
+from telemetry.otel import stage
+from .coalesce import coalesced_search
+from .dynamed import Dynamed
+from .pubmed import PubMed
+from .results import Partial, Redo
+from .semantic_scholar import SemanticScholar
+
+
+SOURCES = {
+    "SemanticScholar": SemanticScholar,
+    "PubMed": PubMed,
+    "Dynamed": Dynamed,
+}
+
+
+def enabled_sources():
+    return [name for name, source in SOURCES.items() if getattr(source, "enabled", lambda: True)()]
+
+
+class RedoRequested(Exception):
+    """
+    Raised when a source asks for the request to be repeated. Letting it propagate out of a
+    queue trigger makes the runtime redeliver the message after its visibility timeout, and
+    move it to the poison queue once maxDequeueCount is reached.
+    """
+    pass
+
+
+def search_messages(keywords, sources=None):
+    for keyword in keywords:
+        for source in sources or enabled_sources():
+            yield json.dumps({"source": source, "keyword": keyword, "token": None})
+
+
+async def run_search_message(message, session):
+    """
+    Runs a single page of a search described by a queue message. Returns the documents found
+    and the message for the next page, or None when the keyword is exhausted.
+    """
+    request = json.loads(message)
+    client = SOURCES[request["source"]](session)
+    keyword = request["keyword"]
+    token = request.get("token")
+
+    logging.info(f'Querying {request["source"]} - {keyword} ({token})')
+    with stage("search.query", source=request["source"], searchkey=keyword, queued=True):
+        result = await coalesced_search(client, keyword, token)
+
+    if isinstance(result, Redo):
+        raise RedoRequested(f'{result} requested a retry')
+
+    if isinstance(result, Partial):
+        follow_up = json.dumps({**request, "token": result.redo.token})
+        return [d.data for d in result.successes], follow_up
+
+    return [d.data for d in result], None
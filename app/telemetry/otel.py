@@ -0,0 +1,113 @@
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from opentelemetry import metrics, trace
+
+
+SERVICE_NAME = "medical-search"
+
+tracer = trace.get_tracer(SERVICE_NAME)
+meter = metrics.get_meter(SERVICE_NAME)
+
+requests_counter = meter.create_counter(
+    "search.requests", description="Upstream HTTP requests made, by source and status")
+retries_counter = meter.create_counter(
+    "search.retries", description="Redo results that were queued for another attempt")
+throttled_counter = meter.create_counter(
+    "search.throttled", description="Upstream responses rejected with 429")
+bytes_counter = meter.create_counter(
+    "http.bytes_received", unit="By", description="Response bytes read from upstream services")
+tokens_counter = meter.create_counter(
+    "ai.tokens", description="OpenAI tokens consumed, by call and kind")
+cache_hits_counter = meter.create_counter(
+    "cache.hits", description="Requests served without going upstream")
+stage_duration = meter.create_histogram(
+    "stage.duration", unit="s", description="Wall-clock time spent per pipeline stage")
+loop_lag = meter.create_histogram(
+    "event_loop.lag", unit="s", description="How late the event loop ran a timer, sampled while profiling")
+
+_configured = False
+
+
+def configure(console=False):
+    """
+    Installs the OpenTelemetry SDK providers. Exports to Application Insights when
+    APPLICATIONINSIGHTS_CONNECTION_STRING is set and to stderr when console is requested
+    (or OTEL_CONSOLE_EXPORTER is set). Without either the API stays a no-op.
+    """
+    global _configured
+    if _configured:
+        return
+    _configured = True
+
+    connection_string = os.environ.get("APPLICATIONINSIGHTS_CONNECTION_STRING")
+    console = console or os.environ.get("OTEL_CONSOLE_EXPORTER", "").lower() in ("1", "true", "yes")
+
+    if not connection_string and not console:
+        logging.debug("Telemetry exporters not configured, spans and metrics are dropped")
+        return
+
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import ConsoleMetricExporter, PeriodicExportingMetricReader
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    resource = Resource.create({"service.name": SERVICE_NAME})
+    tracer_provider = TracerProvider(resource=resource)
+    readers = []
+
+    if connection_string:
+        from azure.monitor.opentelemetry.exporter import AzureMonitorMetricExporter, AzureMonitorTraceExporter
+
+        tracer_provider.add_span_processor(BatchSpanProcessor(
+            AzureMonitorTraceExporter(connection_string=connection_string)))
+        readers.append(PeriodicExportingMetricReader(
+            AzureMonitorMetricExporter(connection_string=connection_string)))
+
+    if console:
+        tracer_provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter(out=sys.stderr)))
+        readers.append(PeriodicExportingMetricReader(ConsoleMetricExporter(out=sys.stderr)))
+
+    trace.set_tracer_provider(tracer_provider)
+    metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=readers))
+    logging.info(f"Telemetry configured (app insights: {bool(connection_string)}, console: {console})")
+
+
+@contextmanager
+def stage(name, **attributes):
+    """
+    Wraps a pipeline stage in a span and records its duration. Only the stage name and
+    source (if given) are used as metric dimensions, everything else goes on the span.
+    """
+    dimensions = {"stage": name}
+    if "source" in attributes:
+        dimensions["source"] = attributes["source"]
+
+    start = time.perf_counter()
+    with tracer.start_as_current_span(name, attributes=attributes) as span:
+        try:
+            yield span
+        finally:
+            stage_duration.record(time.perf_counter() - start, dimensions)
+
+
+def record_response(source, status, size=0):
+    requests_counter.add(1, {"source": source, "status": status})
+    if status == 429:
+        throttled_counter.add(1, {"source": source})
+    if size:
+        bytes_counter.add(size, {"source": source})
+
+
+def record_tokens(call, usage):
+    if usage is None:
+        return
+    tokens_counter.add(usage.prompt_tokens, {"call": call, "kind": "prompt"})
+    tokens_counter.add(usage.completion_tokens, {"call": call, "kind": "completion"})
+    span = trace.get_current_span()
+    span.set_attribute("ai.prompt_tokens", usage.prompt_tokens)
+    span.set_attribute("ai.completion_tokens", usage.completion_tokens)
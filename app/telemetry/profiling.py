@@ -0,0 +1,242 @@
+import asyncio
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+from telemetry.otel import loop_lag
+
+
+def enabled():
+    return os.environ.get("PROFILE_ENABLED", "").lower() in ("1", "true", "yes")
+
+
+def profile_dir():
+    return os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "profiles"))
+
+
+def _label(code):
+    # The function's first line rather than the current one, so samples in the same function fold together
+    path = code.co_filename.replace("\\", "/").split("/")
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class WallSampler:
+    """
+    Samples the stack of the event loop thread from a background thread and counts the folded
+    stacks. Unlike cProfile this sees time spent blocked inside a call (pymongo, PyMuPDF,
+    parsing), and samples ending in the selector are the loop waiting for I/O.
+    """
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class SlowCallbacks(logging.Handler):
+    """
+    Collects the 'Executing <Handle> took N seconds' warnings asyncio logs in debug mode.
+    """
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        message = record.getMessage()
+        if message.startswith("Executing"):
+            self.records.append(message)
+
+
+class Profile:
+    """
+    One profiling run on the current event loop: a wall-clock sampler, cProfile for CPU time, an
+    event loop lag monitor and slow callback capture through the loop's debug mode. stop() writes
+    everything to a directory of its own under PROFILE_DIR:
+
+    - wall.folded: sampled stacks in the folded format flamegraph.pl and speedscope read
+    - cpu.prof: cProfile output for snakeviz or pstats, cpu.txt the top functions by cumulative time
+    - summary.json: event loop lag percentiles and the slow callbacks
+    """
+    def __init__(self, name, directory=None):
+        self.name = name
+        self.directory = directory or profile_dir()
+        self.sample_interval = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", 10)) / 1000
+        self.lag_interval = float(os.environ.get("PROFILE_LAG_INTERVAL_MS", 100)) / 1000
+        self.slow_callback = float(os.environ.get("PROFILE_SLOW_CALLBACK_MS", 100)) / 1000
+
+        self.lags = []
+        self.path = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.started = datetime.now(timezone.utc)
+        self.start_time = time.perf_counter()
+
+        self.sampler = WallSampler(threading.get_ident(), self.sample_interval)
+        self.sampler.start()
+
+        self.cpu = cProfile.Profile()
+        self.cpu.enable()
+
+        self.slow_callbacks = SlowCallbacks()
+        logging.getLogger("asyncio").addHandler(self.slow_callbacks)
+        self.previous_debug = self.loop.get_debug()
+        self.previous_slow_callback = self.loop.slow_callback_duration
+        self.loop.set_debug(True)
+        self.loop.slow_callback_duration = self.slow_callback
+
+        self.lag_task = asyncio.create_task(self._monitor_lag())
+
+    async def _monitor_lag(self):
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(self.loop.time() - start - self.lag_interval, 0)
+            self.lags.append(lag)
+            loop_lag.record(lag, {"profile": self.name})
+
+    async def stop(self):
+        self.lag_task.cancel()
+        try:
+            await self.lag_task
+        except asyncio.CancelledError:
+            pass
+
+        self.cpu.disable()
+        self.sampler.stop()
+        self.loop.set_debug(self.previous_debug)
+        self.loop.slow_callback_duration = self.previous_slow_callback
+        logging.getLogger("asyncio").removeHandler(self.slow_callbacks)
+
+        duration = time.perf_counter() - self.start_time
+        self.path = os.path.join(self.directory, f"{self.name}-{self.started.strftime('%Y%m%dT%H%M%S%f')}")
+        os.makedirs(self.path, exist_ok=True)
+
+        with open(os.path.join(self.path, "wall.folded"), "w") as f:
+            f.write(self.sampler.folded())
+
+        self.cpu.dump_stats(os.path.join(self.path, "cpu.prof"))
+        report = io.StringIO()
+        pstats.Stats(self.cpu, stream=report).sort_stats("cumulative").print_stats(40)
+        with open(os.path.join(self.path, "cpu.txt"), "w") as f:
+            f.write(report.getvalue())
+
+        with open(os.path.join(self.path, "summary.json"), "w") as f:
+            json.dump(self.summary(duration), f, indent=2)
+
+        logging.warning(f"Profile of {self.name} written to {self.path}")
+        await self.upload()
+
+    def summary(self, duration):
+        lags = sorted(self.lags)
+
+        def percentile(p):
+            return lags[min(int(len(lags) * p), len(lags) - 1)] if lags else 0
+
+        return {
+            "name": self.name,
+            "started": self.started.isoformat(),
+            "duration": duration,
+            "wall_samples": sum(self.sampler.stacks.values()),
+            "loop_lag": {
+                "samples": len(lags),
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": lags[-1] if lags else 0,
+            },
+            "slow_callbacks": self.slow_callbacks.records,
+        }
+
+    async def upload(self):
+        """
+        Copies the profile to the PROFILE_CONTAINER blob container, when set, so profiles taken in
+        Azure can be fetched without access to the instance.
+        """
+        container_name = os.environ.get("PROFILE_CONTAINER")
+        if not container_name:
+            return
+
+        from clientlib.registry import registry
+
+        container_client = registry.blob_service().get_container_client(container_name)
+        prefix = os.path.basename(self.path)
+        for file_name in os.listdir(self.path):
+            try:
+                with open(os.path.join(self.path, file_name), "rb") as f:
+                    await container_client.upload_blob(f"{prefix}/{file_name}", f.read(), overwrite=True)
+            except Exception as e:
+                logging.error(f"Error uploading profile {prefix}/{file_name}: {e}")
+
+
+# cProfile and the loop's debug mode are per thread, so overlapping invocations are not profiled
+_active = False
+
+
+@asynccontextmanager
+async def profiled(name, enable=None):
+    """
+    Profiles the enclosed block when enable is true, or PROFILE_ENABLED is set when it is None.
+    """
+    global _active
+    if not (enabled() if enable is None else enable) or _active:
+        yield None
+        return
+
+    _active = True
+    profile = Profile(name)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        try:
+            await profile.stop()
+        except Exception as e:
+            logging.error(f"Error writing the profile of {name}: {e}")
+        _active = False
+
+
+def profile_function(name):
+    """
+    Decorator for async functions, profiled when PROFILE_ENABLED is set.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            async with profiled(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
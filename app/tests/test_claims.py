@@ -0,0 +1,86 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from pymongo.errors import DuplicateKeyError
+
+from dblib import claims
+from dblib.claims import KeywordClaims
+
+
+class FakeCollection:
+    """
+    The claim documents by keyword, with just the queries KeywordClaims makes.
+    """
+    def __init__(self):
+        self.docs = {}
+
+    def insert_one(self, doc):
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("duplicate key")
+        self.docs[doc["_id"]] = dict(doc)
+
+    def find_one_and_update(self, query, update):
+        doc = self.docs.get(query["_id"])
+        owner, expired = query["$or"]
+        if doc is None or not (doc["owner"] == owner["owner"] or doc["expires_at"] < expired["expires_at"]["$lt"]):
+            return None
+        previous = dict(doc)
+        doc.update(update["$set"])
+        return previous
+
+    def delete_one(self, query):
+        if query["_id"] in self.docs and self.docs[query["_id"]]["owner"] == query["owner"]:
+            del self.docs[query["_id"]]
+
+
+def elsewhere():
+    """
+    Another process: the local claim counts are per process.
+    """
+    return mock.patch.object(claims, "_local", claims.Counter())
+
+
+class KeywordClaimsTest(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(claims, "_local", claims.Counter())
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.collection = FakeCollection()
+        self.ours = KeywordClaims(self.collection, ttl=60, owner="ours")
+        self.theirs = KeywordClaims(self.collection, ttl=60, owner="theirs")
+
+    def test_other_instances_are_turned_away(self):
+        self.assertEqual(self.ours.claim_many(["a", "b"]), (["a", "b"], []))
+        with elsewhere():
+            self.assertEqual(self.theirs.claim_many(["b", "c"]), (["c"], ["b"]))
+
+    def test_released_when_the_last_local_search_ends(self):
+        self.assertTrue(self.ours.claim("a"))
+        self.assertTrue(self.ours.claim("a"))
+
+        self.ours.release("a")
+        with elsewhere():
+            self.assertFalse(self.theirs.claim("a"))
+        self.ours.release("a")
+        with elsewhere():
+            self.assertTrue(self.theirs.claim("a"))
+
+    def test_expired_claims_can_be_taken(self):
+        self.ours.reserve("a")
+        self.collection.docs["a"]["expires_at"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+
+        with elsewhere():
+            self.assertTrue(self.theirs.claim("a"))
+        self.assertEqual(self.collection.docs["a"]["owner"], "theirs")
+
+    def test_held_claims_are_not_tracked_locally(self):
+        self.assertEqual(self.ours.claim_many(["a"], hold=True), (["a"], []))
+
+        self.assertEqual(claims._local, {})
+        with elsewhere():
+            self.assertFalse(self.theirs.claim("a"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from ai import download
+from ai.download import PDFTooLarge, downloaded_pdf
+from ai.processor import PDFProcessor
+
+
+class FakeContent:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def iter_chunked(self, size):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class FakeResponse:
+    """
+    A PDF response without a Content-Length.
+    """
+    status = 200
+    content_length = None
+    headers = {"Content-Type": "application/pdf"}
+
+    def __init__(self, chunks):
+        self.content = FakeContent(chunks)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSession:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def head(self, url, **kwargs):
+        return FakeResponse([])
+
+    def get(self, url, **kwargs):
+        return FakeResponse(self.chunks)
+
+
+class FakeClients:
+    def document_intelligence(self):
+        return None
+
+    def openai(self):
+        return None
+
+    def blob_service(self):
+        return None
+
+
+class DownloadTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patch = mock.patch.object(download, "_budget", download.ByteBudget(1000))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    async def test_yields_the_file(self):
+        async with downloaded_pdf(FakeSession([b"%PDF", b"-1.7"]), "https://example.org/a.pdf", max_bytes=100) as path:
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"%PDF-1.7")
+
+    async def test_cap_without_content_length(self):
+        with self.assertRaises(PDFTooLarge):
+            async with downloaded_pdf(FakeSession([b"x" * 60, b"x" * 60]), "https://example.org/a.pdf", max_bytes=100):
+                pass
+        self.assertEqual(download.budget().in_use, 0)
+
+    async def test_oversized_pdf_is_unsupported(self):
+        processor = PDFProcessor(FakeClients())
+        result = SimpleNamespace(figures=[{"boundingRegions": [{"pageNumber": 1, "polygon": [0] * 8}]}], pages=[1])
+        with mock.patch.dict("os.environ", {"PDF_MAX_BYTES": "100"}), \
+                mock.patch.object(processor, "extract_text_from_pdf", mock.AsyncMock(return_value=("Text", result))):
+            prepared = await processor.prepare_pdf(FakeSession([b"x" * 200]), "https://example.org/a.pdf")
+
+        self.assertEqual(prepared["ai_processing"], "unsupported (too large)")
+
+
+if __name__ == '__main__':
+    unittest.main()
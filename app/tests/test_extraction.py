@@ -0,0 +1,115 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from ai.batch import parse_batch_output
+from ai.processor import PDFProcessor
+
+SECTIONS = ["introduction", "results", "conclusion"]
+PREPARED = {"text": "Paper text", "tables_markdown": "", "images": ["figure.png"], "page_count": 3}
+
+
+def completion(content, finish_reason="stop"):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(finish_reason=finish_reason, message=SimpleNamespace(content=content, refusal=None))],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=20, total_tokens=30))
+
+
+class FakeCompletions:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    async def create(self, **request):
+        self.requests.append(request)
+        return self.responses.pop(0)
+
+
+class FakeClients:
+    def __init__(self, completions):
+        self.completions = completions
+
+    def document_intelligence(self):
+        return None
+
+    def openai(self):
+        return SimpleNamespace(chat=SimpleNamespace(completions=self.completions))
+
+    def blob_service(self):
+        return None
+
+
+def batch_line(custom_id, content, finish_reason="stop"):
+    return {
+        "custom_id": custom_id,
+        "error": None,
+        "response": {"status_code": 200, "body": {"choices": [{"finish_reason": finish_reason, "message": {"content": content}}]}},
+    }
+
+
+class ProcessPdfTest(unittest.IsolatedAsyncioTestCase):
+    async def process(self, responses, extraction_mode="combined"):
+        completions = FakeCompletions(responses)
+        processor = PDFProcessor(FakeClients(completions))
+        with mock.patch.object(processor, "prepare_pdf", mock.AsyncMock(return_value=dict(PREPARED))):
+            result = await processor.process_pdf(None, "https://example.org/paper.pdf", SECTIONS, extraction_mode)
+        return result, completions.requests
+
+    async def test_combined(self):
+        extraction = {"sections": {"introduction": "Intro.", "results": "", "conclusion": "Done."}, "tables": []}
+        result, requests = await self.process([completion(json.dumps(extraction))])
+
+        self.assertEqual(result["ai_processing"], "successful")
+        self.assertEqual((result["introduction"], result["conclusion"]), ("Intro.", "Done."))
+        self.assertEqual(len(requests), 1)
+
+    async def test_truncated_combined_falls_back_to_separate(self):
+        result, requests = await self.process([
+            completion('{"sections": {"introduction": "Cut', "length"),
+            completion("Introduction\n\nIntro.\n\nConclusion\n\nDone."),
+        ])
+
+        self.assertEqual(result["ai_processing"], "successful")
+        self.assertEqual(result["introduction"], "Intro.")
+        self.assertNotIn("response_format", requests[1])
+
+    async def test_empty_extraction_fails(self):
+        result, _ = await self.process([completion("")], "separate")
+
+        self.assertEqual(result["ai_processing"], "failed (empty extraction)")
+        self.assertEqual(result["images"], ["figure.png"])
+
+
+class ParseBatchOutputTest(unittest.TestCase):
+    def test_separate_calls(self):
+        results = parse_batch_output([
+            batch_line("doc:sections", "Introduction\n\nIntro.\n\nResults\n\nFound."),
+            batch_line("doc:tables", "| a |"),
+        ], SECTIONS)
+
+        self.assertEqual(results["doc"]["introduction"], "Intro.")
+        self.assertEqual(results["doc"]["results"], "Found.")
+        self.assertEqual(results["doc"]["tables"], "| a |")
+
+    def test_failed_call_fails_the_document(self):
+        failed = {"custom_id": "doc:tables", "response": None, "error": {"code": "server_error"}}
+        results = parse_batch_output([batch_line("doc:sections", "Introduction\n\nIntro."), failed], SECTIONS)
+
+        self.assertEqual(results, {"doc": None})
+
+    def test_empty_extraction(self):
+        results = parse_batch_output([batch_line("doc:sections", "")], SECTIONS)
+
+        self.assertEqual(results, {"doc": None})
+
+    def test_truncated(self):
+        truncated = set()
+        results = parse_batch_output([batch_line("doc:combined", '{"sections": {', "length")], SECTIONS, truncated)
+
+        self.assertEqual(results, {"doc": None})
+        self.assertEqual(truncated, {"doc"})
+
+
+if __name__ == '__main__':
+    unittest.main()
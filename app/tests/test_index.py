@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from querylib.index import InvertedIndex, parse_filters
+
+
+def paper(doc_id, title, citations=0, searchkey="angina", year=2020):
+    return {
+        "_id": doc_id,
+        "searchkey": searchkey,
+        "source": "pubmed",
+        "title": title,
+        "citations": citations,
+        "metadata": {"published_year": year},
+    }
+
+
+class InvertedIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = InvertedIndex()
+        for doc in (
+            paper(1, "Angina treatment", citations=5),
+            paper(2, "Angina angina angina", citations=1),
+            paper(3, "Heart failure", citations=9, searchkey="Heart Failure", year=2010),
+        ):
+            self.index.add(doc)
+
+    def test_ranks_by_bm25(self):
+        response = self.index.search("angina")
+
+        self.assertEqual(response["total"], 2)
+        self.assertEqual([result["_id"] for result in response["results"]], ["2", "1"])
+        self.assertGreater(response["results"][0]["score"], response["results"][1]["score"])
+
+    def test_without_query_orders_by_citations(self):
+        response = self.index.search("")
+
+        self.assertEqual([result["_id"] for result in response["results"]], ["3", "1", "2"])
+
+    def test_pages(self):
+        pages = [self.index.search("", page=page, page_size=2) for page in (1, 2, 3)]
+
+        self.assertEqual([[result["_id"] for result in page["results"]] for page in pages], [["3", "1"], ["2"], []])
+        self.assertEqual({page["total"] for page in pages}, {3})
+
+    def test_filters(self):
+        response = self.index.search("", parse_filters({"year_from": "2015", "min_citations": "2"}))
+
+        self.assertEqual([result["_id"] for result in response["results"]], ["1"])
+
+    def test_replaces_and_removes_documents(self):
+        self.index.add(paper(2, "Unrelated"))
+        self.assertEqual([result["_id"] for result in self.index.search("angina")["results"]], ["1"])
+
+        self.index.remove(1)
+        self.assertEqual(self.index.search("angina")["total"], 0)
+        self.assertEqual(len(self.index), 2)
+
+    def test_projects_fields(self):
+        result, = self.index.search("treatment", fields=["title"])["results"]
+
+        self.assertEqual(set(result), {"_id", "title", "score"})
+
+    def test_save_and_load(self):
+        self.index.add({**paper(4, "Angina in 2024"), "metadata": {"published_date": datetime(2024, 1, 2)}})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.json.gz")
+            self.index.save(path)
+            loaded = InvertedIndex.load(path)
+
+        self.assertEqual(len(loaded), 4)
+        self.assertEqual(loaded.search("angina", page_size=2), self.index.search("angina", page_size=2))
+        loaded.add(paper(5, "Angina again"))
+        self.assertEqual(loaded.search("angina")["total"], 4)
+
+    def test_searchkey_filter_is_canonical(self):
+        for value in ("Angina", " ANGINA ", "heart failure"):
+            with self.subTest(value=value):
+                response = self.index.search("", parse_filters({"searchkey": value}))
+                self.assertEqual(response["total"], 1 if "heart" in value else 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import azure.functions as func
+from bson import ObjectId
+
+import function_app
+from dblib.offload import FieldStore
+from querylib import service
+
+
+class FakeCollection:
+    """
+    Just enough of a pymongo collection for Query: find() on everything or on an $in of ids.
+    """
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query=None, projection=None):
+        ids = (query or {}).get("_id", {}).get("$in")
+        return [dict(doc) for doc in self.docs if ids is None or doc["_id"] in ids]
+
+
+class FakeDownloader:
+    def __init__(self, data):
+        self.data = data
+
+    async def readall(self):
+        return self.data
+
+
+class FakeContainer:
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    async def upload_blob(self, name, data, overwrite=False):
+        self.blobs[name] = data
+
+    async def download_blob(self, name):
+        return FakeDownloader(self.blobs[name])
+
+
+class FakeBlobService:
+    def __init__(self):
+        self.blobs = {}
+
+    def get_container_client(self, name):
+        return FakeContainer(self.blobs)
+
+
+class QueryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.blob_service = FakeBlobService()
+        self.doc_id = ObjectId()
+
+        with mock.patch.dict(os.environ, {"OFFLOAD_THRESHOLD_BYTES": "100"}):
+            values = await FieldStore(self.blob_service).offload(self.doc_id, {
+                "introduction": "angina " * 50,
+                "conclusion": "Short.",
+            })
+        self.collection = FakeCollection([{
+            "_id": self.doc_id,
+            "searchkey": "angina",
+            "source": "pubmed",
+            "title": "Stable angina",
+            "citations": 3,
+            **values,
+        }])
+
+        patches = [
+            mock.patch.dict(os.environ, {"QUERY_INDEX_PATH": os.path.join(self.directory.name, "index")}),
+            mock.patch.object(function_app, "get_collection", lambda: self.collection),
+            mock.patch.object(function_app.registry, "blob_service", lambda: self.blob_service),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        service.invalidate_index()
+        self.addCleanup(service.invalidate_index)
+        self.addCleanup(self.directory.cleanup)
+
+    async def query(self, params=None, body=b""):
+        request = func.HttpRequest("POST", "/api/Query", body=body, params=params or {})
+        return await function_app.Query.build().get_user_function()(request)
+
+    async def test_returns_requested_ai_fields(self):
+        response = await self.query({"q": "angina", "fields": "title,introduction,conclusion"})
+
+        self.assertEqual(response.status_code, 200)
+        result, = json.loads(response.get_body())["results"]
+        self.assertEqual(result["_id"], str(self.doc_id))
+        self.assertEqual(result["title"], "Stable angina")
+        self.assertEqual(result["introduction"], "angina " * 50)
+        self.assertEqual(result["conclusion"], "Short.")
+
+    async def test_rejects_non_object_body(self):
+        for body in (b"[]", b'"angina"'):
+            response = await self.query(body=body)
+            self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from pymongo import UpdateOne
+
+from ai.scheduler import AIBatchScheduler
+
+
+class FakeResponse:
+    def __init__(self, content_length):
+        self.content_length = content_length
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSession:
+    def __init__(self, lengths):
+        self.lengths = lengths
+        self.requested = []
+
+    def head(self, url, **kwargs):
+        self.requested.append(url)
+        return FakeResponse(self.lengths.get(url))
+
+
+class FakeCollection:
+    def __init__(self):
+        self.writes = []
+
+    def bulk_write(self, requests, ordered=True):
+        self.writes.extend(requests)
+
+
+class ProbeSizesTest(unittest.IsolatedAsyncioTestCase):
+    async def test_probes_each_document_once(self):
+        collection = FakeCollection()
+        scheduler = AIBatchScheduler(collection, "test")
+        session = FakeSession({"https://example.org/known.pdf": 2048})
+        docs = [
+            {"_id": 1, "pdf_url": "https://example.org/known.pdf"},
+            {"_id": 2, "pdf_url": "https://example.org/unknown.pdf"},
+            {"_id": 3, "pdf_url": "https://example.org/probed.pdf", "pdf_size_probed": True},
+            {"_id": 4, "pdf_url": "https://example.org/sized.pdf", "pdf_size": 1024},
+        ]
+
+        await scheduler.probe_sizes(session, docs)
+
+        self.assertEqual(session.requested, ["https://example.org/known.pdf", "https://example.org/unknown.pdf"])
+        self.assertEqual(docs[0]["pdf_size"], 2048)
+        self.assertEqual(collection.writes, [
+            UpdateOne({"_id": 1}, {"$set": {"pdf_size": 2048}}),
+            UpdateOne({"_id": 2}, {"$set": {"pdf_size_probed": True}}),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
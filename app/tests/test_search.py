@@ -0,0 +1,40 @@
+import json
+import unittest
+
+import azure.functions as func
+
+import function_app
+
+
+class Out(func.Out):
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class SearchValidationTest(unittest.IsolatedAsyncioTestCase):
+    async def search(self, body):
+        request = func.HttpRequest("POST", "/api/Search", body=json.dumps(body).encode(), params={})
+        return await function_app.Search.build().get_user_function()(request, Out())
+
+    async def test_rejects_invalid_bodies(self):
+        for body in (
+            [],
+            "angina",
+            {"keywords": ["angina"]},
+            {"keywords": "angina", "priorities": ["angina"]},
+            {"keywords": "angina", "priorities": {"angina": "high"}},
+            {"keywords": "angina", "priorities": {"angina": True}},
+        ):
+            with self.subTest(body=body):
+                response = await self.search(body)
+                self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from searchlib.results import Partial, Redo
+from searchlib.scheduler import SourceScheduler
+
+
+def result(searchkey, page):
+    return SimpleNamespace(data={"searchkey": searchkey, "page": page})
+
+
+class PagedClient:
+    """
+    Two pages per keyword; records the calls and how many run at once.
+    """
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+
+    async def search(self, searchkey, token=None):
+        self.calls.append((searchkey, token))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0)
+            if searchkey in self.failing:
+                raise RuntimeError("upstream error")
+            if "page" not in (token or {}):
+                return Partial([result(searchkey, 1)], Redo(searchkey, self, {"page": 2}))
+            return [result(searchkey, token["page"])]
+        finally:
+            self.running -= 1
+
+
+class SourceSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_pages_every_keyword(self):
+        client = PagedClient()
+        results = await SourceScheduler(client, workers=2).run(["a", "b", "c"])
+
+        self.assertEqual(sorted((r["searchkey"], r["page"]) for r in results),
+                         [("a", 1), ("a", 2), ("b", 1), ("b", 2), ("c", 1), ("c", 2)])
+        self.assertLessEqual(client.max_running, 2)
+
+    async def test_priorities_run_first(self):
+        client = PagedClient()
+        await SourceScheduler(client, workers=1, max_active=1).run(["a", "b", "c"], priorities={"c": -1, "a": 1})
+
+        self.assertEqual([searchkey for searchkey, _ in client.calls], ["c", "c", "b", "b", "a", "a"])
+
+    async def test_pages_round_robin(self):
+        client = PagedClient()
+        await SourceScheduler(client, workers=1, max_active=2).run(["a", "b"])
+
+        self.assertEqual(client.calls, [("a", None), ("b", None), ("a", {"page": 2}), ("b", {"page": 2})])
+
+    async def test_gives_up_after_retries(self):
+        client = PagedClient(failing=["b"])
+        scheduler = SourceScheduler(client, workers=2, retries=2)
+        results = await scheduler.run(["a", "b"])
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(client.calls.count(("b", None)), 3)
+        self.assertEqual([failure.searchkey for failure in scheduler.failures], ["b"])
+
+    async def test_since_is_passed_as_token(self):
+        client = PagedClient()
+        scheduler = SourceScheduler(client, workers=1)
+        await scheduler.run(["a"], since={"a": "2024-01-01"})
+
+        self.assertEqual(client.calls[0], ("a", {"since": "2024-01-01"}))
+        self.assertEqual(scheduler.failures, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
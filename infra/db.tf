@@ -59,4 +59,26 @@ resource "azurerm_cosmosdb_mongo_collection" "main" {
     keys   = ["_id"]
     unique = true
   }
+
+  # created by the function app on startup as well, kept here so terraform does not drop them
+  index {
+    keys = ["searchkey"]
+  }
+
+  # refreshes merge on these
+  index {
+    keys = ["searchkey", "source", "external_id"]
+  }
+
+  index {
+    keys = ["ai_processed"]
+  }
+
+  index {
+    keys = ["ai_processed", "citations"]
+  }
+
+  index {
+    keys = ["ai_processed", "metadata.published_year", "metadata.published_date", "citations"]
+  }
 }
\ No newline at end of file
@@ -12,12 +12,28 @@ resource "azurerm_storage_account" "main" {
   account_replication_type = "LRS"
 }
 
+resource "azurerm_storage_queue" "search_requests" {
+  name                 = "search-requests"
+  storage_account_name = azurerm_storage_account.main.name
+}
+
+resource "azurerm_storage_queue" "ai_requests" {
+  name                 = "ai-requests"
+  storage_account_name = azurerm_storage_account.main.name
+}
+
 resource "azurerm_storage_container" "images" {
   name                  = "journal-images"
   storage_account_name  = azurerm_storage_account.main.name
   container_access_type = "private"
 }
 
+resource "azurerm_storage_container" "fields" {
+  name                  = "journal-fields"
+  storage_account_name  = azurerm_storage_account.main.name
+  container_access_type = "private"
+}
+
 data "namep_azure_name" "sp" {
   name     = "main"
   location = "westeurope"
@@ -82,6 +98,7 @@ resource "azurerm_linux_function_app" "main" {
     "OPENAI_DEPLOYMENT_NAME"              = azurerm_cognitive_deployment.main["gpt-4"].model[0].name
     "AZURE_STORAGE_ACCOUNT_URL"           = azurerm_storage_account.main.primary_blob_endpoint
     "AZURE_STORAGE_CONTAINER_NAME"        = azurerm_storage_container.images.name
+    "AZURE_STORAGE_OFFLOAD_CONTAINER"     = azurerm_storage_container.fields.name
   }
 
   identity {